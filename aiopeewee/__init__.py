@@ -1,5 +1,8 @@
 from .model import AioModel
 from .mysql import AioMySQLDatabase
+from .sqlite import AioSqliteDatabase
+from .postgres import AioPostgresqlDatabase, AioAsyncpgDatabase
+from .sharding import ShardedAioDatabase
 from .fields import AioManyToManyField
 from .shortcuts import model_to_dict
 
@@ -1,5 +1,8 @@
+import sys
 import uuid
+from collections import OrderedDict
 from functools import wraps
+from peewee import sort_models_topologically
 # from peewee import ExecutionContext, Using
 
 
@@ -71,32 +74,49 @@ class _aio_callable_context_manager(object):
 
 class _aio_atomic(_aio_callable_context_manager):
 
-    __slots__ = ('conn', 'transaction_type', 'context_manager')
+    __slots__ = ('db', 'conn', 'transaction_type', 'context_manager')
 
-    def __init__(self, conn, transaction_type=None):
-        self.conn = conn
+    def __init__(self, db, transaction_type=None):
+        self.db = db
         self.transaction_type = transaction_type
 
     async def __aenter__(self):
+        self.conn = self.db.get_conn()
         await self.conn.__aenter__()
-        if self.conn.transaction_depth() == 0:
-            self.context_manager = self.conn.transaction(self.transaction_type)
-        else:
-            self.context_manager = self.conn.savepoint()
-        return await self.context_manager.__aenter__()
+        try:
+            if self.conn.transaction_depth() == 0:
+                # queries issued by this task run on the same connection
+                # until the outermost block exits
+                self.db.bind_conn(self.conn)
+                self.context_manager = self.conn.transaction(
+                    self.transaction_type)
+            else:
+                self.context_manager = self.conn.savepoint()
+            return await self.context_manager.__aenter__()
+        except BaseException:
+            await self._release(*sys.exc_info())
+            raise
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.context_manager.__aexit__(exc_type, exc_val, exc_tb)
+        try:
+            await self.context_manager.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            await self._release(exc_type, exc_val, exc_tb)
+
+    async def _release(self, exc_type, exc_val, exc_tb):
+        if self.conn.transaction_depth() == 0:
+            self.db.unbind_conn()
         await self.conn.__aexit__(exc_type, exc_val, exc_tb)
 
 
 class aio_transaction(_aio_callable_context_manager):
 
-    __slots__ = ('conn', 'autocommit', 'transaction_type')
+    __slots__ = ('conn', 'autocommit', 'transaction_type', 'span')
 
     def __init__(self, conn, transaction_type=None):
         self.conn = conn
         self.transaction_type = transaction_type
+        self.span = None
 
     async def _begin(self):
         if self.transaction_type:
@@ -119,6 +139,7 @@ class aio_transaction(_aio_callable_context_manager):
         self.conn.autocommit = False
 
         if self.conn.transaction_depth() == 0:
+            self.span = self.conn.database.span('db.transaction').__enter__()
             await self._begin()
         self.conn.push_transaction(self)
         return self
@@ -132,10 +153,13 @@ class aio_transaction(_aio_callable_context_manager):
                     await self.commit(False)
                 except:
                     await self.rollback(False)
+                    exc_type, exc_val, exc_tb = sys.exc_info()
                     raise
         finally:
             self.conn.autocommit = self.autocommit
             self.conn.pop_transaction()
+            if self.span is not None:
+                self.span.__exit__(exc_type, exc_val, exc_tb)
 
 
 class aio_savepoint(_aio_callable_context_manager):
@@ -145,9 +169,7 @@ class aio_savepoint(_aio_callable_context_manager):
     def __init__(self, conn, sid=None):
         self.conn = conn
         self.sid = sid or uuid.uuid4().hex
-
-        _compiler = conn.compiler()  # TODO: breing the compiler here somehow
-        self.quoted_sid = _compiler.quote(self.sid)
+        self.quoted_sid = conn.database.compiler().quote(self.sid)
 
     async def _execute(self, query):
         await self.conn.execute_sql(query, require_commit=False)
@@ -167,8 +189,8 @@ class aio_savepoint(_aio_callable_context_manager):
         raise NotImplementedError()
 
     async def __aenter__(self):
-        self.autocommit = self.conn.get_autocommit()
-        self.conn.set_autocommit(False)
+        self.autocommit = self.conn.autocommit
+        self.conn.autocommit = False
         await self._begin()
         return self
 
@@ -186,4 +208,136 @@ class aio_savepoint(_aio_callable_context_manager):
                     await self.rollback()
                     raise
         finally:
-            self.conn.set_autocommit(self.autocommit)
+            self.conn.autocommit = self.autocommit
+
+
+class aio_unit_of_work(object):
+    """Collect created, modified and deleted instances and flush them at once.
+
+    On a clean exit the pending changes are written in a single transaction:
+    batched INSERTs parents first, one ``bulk_update`` per model, then
+    ``DELETE ... WHERE pk IN`` children first.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.created = OrderedDict()
+        self.modified = OrderedDict()
+        self.deleted = OrderedDict()
+
+    def add(self, *instances, force_insert=False):
+        for instance in instances:
+            key = id(instance)
+            if key in self.created or key in self.modified:
+                continue
+            if (force_insert or instance._meta.primary_key is False or
+                    instance._get_pk_value() is None):
+                self.created[key] = instance
+            else:
+                self.modified[key] = instance
+
+    def delete(self, *instances):
+        for instance in instances:
+            key = id(instance)
+            self.modified.pop(key, None)
+            if self.created.pop(key, None) is None:
+                self.deleted[key] = instance
+
+    def _group(self, instances):
+        groups = OrderedDict()
+        for instance in instances.values():
+            groups.setdefault(type(instance), []).append(instance)
+        return groups
+
+    async def _insert(self, model, instances):
+        pk_field = model._meta.primary_key
+        # RETURNING hands back the generated keys of a multi-row insert
+        returning = (model._meta.database.insert_returning and
+                     not model._meta.composite_key)
+        rows = OrderedDict()
+        for instance in instances:
+            generated = (pk_field is not False and
+                         instance._get_pk_value() is None)
+            if generated and not returning:
+                # the generated key is needed on the instance
+                await instance.save(force_insert=True)
+                continue
+            field_dict = dict(instance._data)
+            if generated:
+                field_dict.pop(pk_field.name, None)
+            instance._populate_unsaved_relations(field_dict)
+            key = (generated, frozenset(field_dict))
+            rows.setdefault(key, []).append((instance, field_dict))
+            instance._dirty.clear()
+
+        for (generated, _), batch in rows.items():
+            query = model.insert_many([field_dict for _, field_dict in batch])
+            if generated:
+                ids = await query.return_id_list().execute()
+                for (instance, _), pk in zip(batch, ids):
+                    instance._set_pk_value(pk)
+            else:
+                await query.execute()
+
+    async def _update(self, model, instances):
+        if model._meta.composite_key:
+            for instance in instances:
+                await instance.save()
+        else:
+            await model.bulk_update(instances)
+
+    async def _delete(self, model, instances):
+        if model._meta.composite_key:
+            for instance in instances:
+                await instance.delete_instance()
+        else:
+            pk_field = model._meta.primary_key
+            ids = [instance._get_pk_value() for instance in instances]
+            await model.delete().where(pk_field << ids).execute()
+
+    async def flush(self):
+        created = self._group(self.created)
+        modified = self._group(self.modified)
+        deleted = self._group(self.deleted)
+        models = sort_models_topologically(
+            set(created) | set(modified) | set(deleted))
+        if not models:
+            return
+
+        # the generated keys and dirty fields are restored on a rollback, the
+        # changes stay pending until the transaction is committed
+        state = [(instance, instance._meta.primary_key is not False and
+                  instance._get_pk_value(), set(instance._dirty))
+                 for instances in (self.created, self.modified)
+                 for instance in instances.values()]
+        try:
+            async with self.db.atomic():
+                for model in models:
+                    if model in created:
+                        await self._insert(model, created[model])
+                for model in models:
+                    if model in modified:
+                        await self._update(model, modified[model])
+                for model in reversed(models):
+                    if model in deleted:
+                        await self._delete(model, deleted[model])
+        except BaseException:
+            for instance, pk, dirty in state:
+                if pk is not False:
+                    instance._set_pk_value(pk)
+                instance._dirty = dirty
+            raise
+        self.created.clear()
+        self.modified.clear()
+        self.deleted.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type:
+            self.created.clear()
+            self.modified.clear()
+            self.deleted.clear()
+        else:
+            await self.flush()
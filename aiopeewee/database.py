@@ -1,16 +1,33 @@
+import sys
+import time
+import asyncio
+import logging
 import threading
+from itertools import count
+from weakref import WeakKeyDictionary
 from peewee import Database, ExceptionWrapper, basestring
 from peewee import sort_models_topologically, merge_dict
-from peewee import OperationalError
+from peewee import OperationalError, DatabaseError
 from peewee import (RESULTS_NAIVE, RESULTS_TUPLES, RESULTS_DICTS,
                     RESULTS_AGGREGATE_MODELS, RESULTS_MODELS)
 from peewee import SQL, R, Clause, fn, binary_construct
 from peewee import logger
 
-from .context import _aio_atomic, aio_transaction, aio_savepoint
+from .context import (_aio_atomic, aio_transaction, aio_savepoint,
+                      aio_unit_of_work)
 from .result import (AioNaiveQueryResultWrapper, AioModelQueryResultWrapper,
                      AioTuplesQueryResultWrapper, AioDictQueryResultWrapper,
                      AioAggregateQueryResultWrapper)
+from .metrics import PoolMetrics, StatementStats, QueryBudget
+from .slowlog import SlowQueryLog
+from .tracing import NOOP_SPAN
+from .utils import current_task
+
+
+HOOK_EVENTS = ('before_execute', 'after_execute', 'on_error')
+REPLICA_POLICIES = ('round_robin', 'least_busy')
+# replication position of a write which has not been looked up yet
+_UNKNOWN = object()
 
 
 # remove this one, just use autocommit arg in db.execute_sql
@@ -19,14 +36,22 @@ from .result import (AioNaiveQueryResultWrapper, AioModelQueryResultWrapper,
 class AioConnection(object):
 
     def __init__(self, acquirer, exception_wrapper,
-                 autocommit=None, autorollback=None):
+                 autocommit=None, autorollback=None, database=None,
+                 pool=None):
         self.autocommit = autocommit
         self.autorollback = autorollback
         self.acquirer = acquirer
+        self.database = database
+        # the pool of the server the connection belongs to
+        self.pool = pool
         self.closed = True
         self.conn = None
+        self.refs = 0
+        self.acquired_at = None
+        self.query_time = 0.0
         self.context_stack = []
         self.transactions = []
+        self.wrote = False
         self.exception_wrapper = exception_wrapper  # TODO: remove
 
     def transaction_depth(self):
@@ -38,38 +63,144 @@ class AioConnection(object):
     def pop_transaction(self):
         return self.transactions.pop()
 
-    async def execute_sql(self, sql, params=None, require_commit=True):
-        logger.debug((sql, params))
+    async def execute_sql(self, sql, params=None, require_commit=True,
+                          cursor_class=None, timeout=None):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug((sql, params))
+        hooks = self.database._hooks
+        if not hooks and not self.database.pool_metrics.time_queries:
+            # nothing measures the statement, skip the timing
+            return await self._execute_sql(sql, params, require_commit,
+                                           cursor_class, timeout)
+
+        if hooks:
+            connection_id = self.database.connection_id(self.conn)
+            for hook in hooks.get('before_execute', ()):
+                hook(sql, params, connection_id)
+
+        start = time.perf_counter()
+        try:
+            cursor = await self._execute_sql(sql, params, require_commit,
+                                             cursor_class, timeout)
+        except (Exception, asyncio.CancelledError) as exc:
+            duration = time.perf_counter() - start
+            self.query_time += duration
+            if hooks:
+                for hook in hooks.get('on_error', ()):
+                    hook(sql, params, duration, exc, connection_id)
+            raise
+        duration = time.perf_counter() - start
+        self.query_time += duration
+        if hooks:
+            for hook in hooks.get('after_execute', ()):
+                hook(sql, params, duration, cursor.rowcount, connection_id)
+        return cursor
+
+    async def _execute_sql(self, sql, params, require_commit, cursor_class,
+                           timeout):
         with self.exception_wrapper:
-            cursor = await self.conn.cursor()
+            if cursor_class is None:
+                cursor = await self.conn.cursor()
+            else:
+                cursor = await self.conn.cursor(cursor_class)
             try:
-                await cursor.execute(sql, params or ())
+                if timeout:
+                    await asyncio.wait_for(cursor.execute(sql, params or ()),
+                                           timeout)
+                else:
+                    await cursor.execute(sql, params or ())
+            except asyncio.TimeoutError:
+                await self.kill()
+                raise OperationalError('Query execution exceeded the %ss '
+                                       'timeout' % timeout)
+            except asyncio.CancelledError:
+                await self.kill()
+                raise
             except Exception:
                 if self.autorollback and self.autocommit:
                     await self.rollback()
                 raise
             else:
+                if require_commit and self.database.read_your_writes:
+                    # the replication position is recorded on commit
+                    self.wrote |= sql[:6].upper() != 'SELECT'
                 if require_commit and self.autocommit:
                     await self.commit()
             return cursor
 
     async def __aenter__(self):
-        self.conn = await self.acquirer.__aenter__()
+        # re-entrant, a connection bound by an atomic block is entered by
+        # every query executed inside of it
+        if not self.refs:
+            metrics = self.database.pool_metrics
+            start = time.perf_counter()
+            metrics.waiting += 1
+            try:
+                with self.database.span('db.connection.acquire'):
+                    self.conn = await self.acquirer.__aenter__()
+            finally:
+                metrics.waiting -= 1
+            self.acquired_at = time.perf_counter()
+            self.query_time = 0.0
+            metrics.acquired(self.conn, self.acquired_at - start)
+            self.closed = False
+        self.refs += 1
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.acquirer.__aexit__(exc_type, exc_val, exc_tb)
-
-    async def begin(self):
-        pass
-
-    def commit(self):
-        with self.exception_wrapper:
-            return self.conn.commit()
-
-    def rollback(self):
+        self.refs -= 1
+        if not self.refs:
+            self.closed = True
+            self.database.pool_metrics.released(
+                self.conn, time.perf_counter() - self.acquired_at,
+                self.query_time)
+            await self.acquirer.__aexit__(exc_type, exc_val, exc_tb)
+
+    async def kill(self):
+        """Abort the running statement and discard the connection.
+
+        Used when the awaiting task is cancelled: the socket state is unknown,
+        so the connection is closed (the pool drops closed connections) and
+        the statement is killed on the same server (the primary or a replica)
+        through another connection.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        thread_id = self.database.connection_id(self.conn)
+        self.conn.close()
+        await asyncio.shield(self.database.kill_query(thread_id,
+                                                      pool=self.pool))
+
+    async def begin(self, transaction_type=None):
+        if self.database.explicit_transactions:
+            sql = 'BEGIN %s' % transaction_type if transaction_type else 'BEGIN'
+            await self.execute_sql(sql, require_commit=False)
+
+    async def commit(self):
+        if self.database.explicit_transactions:
+            # statements outside of transactions are committed by the server
+            if self.transaction_depth():
+                await self.execute_sql('COMMIT', require_commit=False)
+        else:
+            with self.exception_wrapper:
+                await self.conn.commit()
+        if self.wrote:
+            self.wrote = False
+            self.database.record_write()
+
+    async def rollback(self):
+        self.wrote = False
+        if self.closed:
+            # nothing to roll back, the server discards the transaction of a
+            # closed connection
+            return
+        if self.database.explicit_transactions:
+            if self.transaction_depth():
+                await self.execute_sql('ROLLBACK', require_commit=False)
+            return
         with self.exception_wrapper:
-            return self.conn.rollback()
+            await self.conn.rollback()
 
     # def close(self):
     #     # self.conn_pool.release(conn)
@@ -80,13 +211,74 @@ class AioConnection(object):
     commit_on_success = property(transaction)
 
     def savepoint(self, sid=None):
-        if not self.savepoints:
+        if not self.database.savepoints:
             raise NotImplementedError
         return aio_savepoint(self, sid)
 
 
+class _ReplicaRead(object):
+    """Connection of a read which must see the last write of the task.
+
+    Waits for the replica to apply the write, the read falls back to the
+    primary when it does not catch up in time.
+    """
+
+    def __init__(self, database, pool, write):
+        self.database = database
+        self.pool = pool
+        self.write = write
+        self.conn = None
+
+    async def _wait(self, conn):
+        if self.pool in self.write[1]:
+            return True
+        if not self.database.replica_wait:
+            return False
+        try:
+            if self.write[0] is _UNKNOWN:
+                # looked up once, by the first replica read after the write
+                async with self.database._new_conn() as primary:
+                    self.write[0] = await self.database.write_position(
+                        primary)
+            if self.write[0] is None:
+                return False
+            if await self.database.wait_for_position(
+                    conn, self.write[0], self.database.replica_wait):
+                self.write[1].add(self.pool)
+                return True
+        except DatabaseError:
+            logger.warning('Failed to wait for the replica', exc_info=True)
+        return False
+
+    async def __aenter__(self):
+        conn = self.database._new_conn(self.pool)
+        await conn.__aenter__()
+        try:
+            caught_up = await self._wait(conn)
+        except BaseException:
+            await conn.__aexit__(*sys.exc_info())
+            raise
+        if not caught_up:
+            await conn.__aexit__(None, None, None)
+            conn = self.database._new_conn()
+            await conn.__aenter__()
+        self.conn = conn
+        return conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.conn.__aexit__(exc_type, exc_val, exc_tb)
+
+
 class AioDatabase(Database):
 
+    # unbuffered cursor class used by AioSelectQuery.batches(server_side=True)
+    server_side_cursor = None
+    explain_prefix = 'EXPLAIN'
+    # db.system of the tracing spans
+    system = 'other_sql'
+    # drivers always in autocommit mode (aiopg) need BEGIN/COMMIT statements
+    explicit_transactions = False
+
     def begin(self):
         raise NotImplementedError
 
@@ -121,33 +313,252 @@ class AioDatabase(Database):
         raise NotImplementedError
 
     def __init__(self, database, threadlocals=True, autocommit=True,
-                 fields=None, ops=None, autorollback=False,
-                 **connect_kwargs):
+                 fields=None, ops=None, autorollback=False, timeout=None,
+                 track_statements=False, track_query_time=False,
+                 replicas=None,
+                 replica_policy='round_robin', read_your_writes=False,
+                 replica_wait=1.0, **connect_kwargs):
+        if replica_policy not in REPLICA_POLICIES:
+            raise ValueError('Unknown replica policy "%s"' % replica_policy)
         self.connect_kwargs = {}
         self.closed = True
-        self.init(database, **connect_kwargs)
+        self.replicas = []
+        self.init(database, replicas=replicas, **connect_kwargs)
 
         self.pool = None
+        self.replica_pools = []
+        self.replica_policy = replica_policy
+        self._replica_counter = count()
+        # replica reads of a task wait for its last write, at most
+        # replica_wait seconds
+        self.read_your_writes = read_your_writes
+        self.replica_wait = replica_wait
+        self._task_writes = WeakKeyDictionary()
 
         self.autocommit = autocommit
         self.autorollback = autorollback
+        self.timeout = timeout
         self.use_speedups = False
 
         self.field_overrides = merge_dict(self.field_overrides, fields or {})
         self.op_overrides = merge_dict(self.op_overrides, ops or {})
         self.exception_wrapper = ExceptionWrapper(self.exceptions)
 
+        # connections bound to tasks by atomic blocks
+        self._task_conns = WeakKeyDictionary()
+        # execution hooks by event, empty unless something is registered
+        self._hooks = {}
+        self.pool_metrics = PoolMetrics(time_queries=track_query_time)
+        self.statements = StatementStats(self)
+        # a tracing.Tracer, spans are not created when unset
+        self.tracer = None
+        if track_statements:
+            self.statements.start()
+
+    def init(self, database, replicas=None, **connect_kwargs):
+        """Set the connection arguments.
+
+        `replicas` is a list of connection arguments of the read replicas,
+        each overriding the arguments of the primary (e.g. ``{'host': ...}``).
+        """
+        if replicas is not None:
+            self.replicas = [dict(replica) for replica in replicas]
+        super().init(database, **connect_kwargs)
+
     def is_closed(self):
         return self.closed
 
-    def get_conn(self):
+    def get_conn(self, read_only=False, query=None):
+        """Connection of the task's transaction or a new one from the pool.
+
+        Outside of transactions `read_only` statements are routed to the
+        replicas, when there are any. `query` is the query to be executed,
+        if any.
+        """
         if self.closed:
             raise OperationalError('Database pool has not been initialized')
 
-        return AioConnection(self.pool.acquire(),
+        conn = self.bound_conn()
+        if conn is not None:
+            return conn
+        if read_only and self.replica_pools:
+            pool = self._replica_pool()
+            task = current_task()
+            if task is not None and task in self._task_writes:
+                return _ReplicaRead(self, pool, self._task_writes[task])
+            return self._new_conn(pool)
+        return self._new_conn()
+
+    def instance_expr(self, instance, expr):
+        """Condition matching the row of `instance`.
+
+        `expr` matches its primary key, databases which route rows by other
+        columns add them.
+        """
+        return expr
+
+    def database_for(self, model_class, data):
+        """Database storing a row of `model_class` with the given `data`."""
+        return self
+
+    def partition(self, model_class, instances_or_query):
+        """Split instances or a query by the database storing their rows.
+
+        Returns ``(database, instances_or_query)`` pairs.
+        """
+        return [(self, instances_or_query)]
+
+    def _replica_pool(self):
+        pools = self.replica_pools
+        start = next(self._replica_counter)
+        if self.replica_policy == 'least_busy':
+            # the fewest connections in use, ties are taken in turns
+            return min((pools[(start + i) % len(pools)]
+                        for i in range(len(pools))),
+                       key=lambda pool: pool.size - pool.freesize)
+        return pools[start % len(pools)]
+
+    def record_write(self):
+        """Remember that the task committed a write.
+
+        Its replication position is looked up by the next replica read of the
+        task, so writes which are not followed by one cost nothing.
+        """
+        task = current_task()
+        if task is not None and self.replica_pools:
+            self._task_writes[task] = [_UNKNOWN, set()]
+
+    async def write_position(self, conn):
+        """Current replication position of the primary `conn`.
+
+        It includes the writes committed so far. None when unknown, the
+        following reads use the primary.
+        """
+        return None
+
+    async def wait_for_position(self, conn, position, timeout):
+        """Wait until the replica of `conn` has applied `position`."""
+        return False
+
+    def _new_conn(self, pool=None):
+        pool = pool or self.pool
+        return AioConnection(pool.acquire(),
                              autocommit=self.autocommit,
                              autorollback=self.autorollback,
-                             exception_wrapper=self.exception_wrapper)
+                             exception_wrapper=self.exception_wrapper,
+                             database=self, pool=pool)
+
+    def bound_conn(self):
+        task = current_task()
+        if task is not None:
+            return self._task_conns.get(task)
+
+    def bind_conn(self, conn):
+        task = current_task()
+        if task is None:
+            raise OperationalError('Connections can only be bound to tasks')
+        self._task_conns[task] = conn
+
+    def unbind_conn(self):
+        return self._task_conns.pop(current_task(), None)
+
+    def add_hook(self, event, hook):
+        """Call `hook` around every statement executed by this database.
+
+        Events and their hook arguments:
+
+        * before_execute(sql, params, connection_id)
+        * after_execute(sql, params, duration, rowcount, connection_id)
+        * on_error(sql, params, duration, exc, connection_id)
+
+        Hooks are plain callables run inline, they should not block.
+        """
+        if event not in HOOK_EVENTS:
+            raise ValueError('Unknown execution event "%s"' % event)
+        self._hooks[event] = self._hooks.get(event, ()) + (hook,)
+        return hook
+
+    def remove_hook(self, event, hook):
+        hooks = tuple(h for h in self._hooks.get(event, ()) if h != hook)
+        if hooks:
+            self._hooks[event] = hooks
+        else:
+            self._hooks.pop(event, None)
+
+    def span(self, name, statement=None):
+        """Start a tracing span, a no-op unless a tracer is set."""
+        if self.tracer is None:
+            return NOOP_SPAN
+        attributes = {'db.system': self.system, 'db.name': self.database}
+        if statement is not None:
+            attributes['db.statement'] = statement
+            attributes['db.operation'] = statement.split(None, 1)[0].upper()
+        return self.tracer.start_span(name, attributes)
+
+    def pool_stats(self):
+        """Connection pool usage since the database has been created.
+
+        Wait, hold and query times are histograms of per acquisition
+        durations: the time waited for a connection, the time it was kept
+        and the time spent executing statements on it. Query times are only
+        measured when created with `track_query_time=True`.
+        """
+        metrics = self.pool_metrics
+        size = getattr(self.pool, 'size', None)
+        stats = {
+            'size': size,
+            'maxsize': getattr(self.pool, 'maxsize', None),
+            'free': getattr(self.pool, 'freesize', None),
+            'in_use': metrics.in_use,
+            'waiters': metrics.waiting,
+            'created': metrics.created,
+            'closed': metrics.closed,
+            'acquire_wait': metrics.acquire_wait.as_dict(),
+            'hold_time': metrics.hold_time.as_dict(),
+            'query_time': metrics.query_time.as_dict(),
+        }
+        return stats
+
+    def statement_stats(self, reset=False):
+        """Per fingerprint statistics of the executed statements.
+
+        Collected when created with `track_statements=True` or after
+        `db.statements.start()`.
+        """
+        stats = self.statements.as_list()
+        if reset:
+            self.statements.reset()
+        return stats
+
+    def query_budget(self, max_queries=None, warn_repeated=5, strict=False):
+        """Report repeated statements and excess statements of a block.
+
+        .. code:: python
+
+            async with db.query_budget(max_queries=20, strict=True):
+                await model_to_dict(user, backrefs=True)
+        """
+        return QueryBudget(self, max_queries, warn_repeated, strict)
+
+    def slow_query_log(self, threshold=1.0, size=100, explain_rate=1.0,
+                       path=None):
+        """Start recording statements slower than `threshold` seconds."""
+        return SlowQueryLog(self, threshold, size, explain_rate, path).start()
+
+    def connection_id(self, conn):
+        """Identifier of the driver connection passed to execution hooks."""
+        return id(conn)
+
+    def timeout_hint(self, sql, timeout):
+        """Let the server enforce `timeout` seconds on the statement."""
+        return sql
+
+    async def kill_query(self, thread_id, pool=None):
+        """Abort the statement executed by the given connection thread.
+
+        `pool` is the pool of the connection, the primary one by default.
+        """
+        pass
 
     async def close(self):
         if self.deferred:
@@ -155,9 +566,13 @@ class AioDatabase(Database):
                             'before closing connection')
         with self.exception_wrapper:
             if not self.closed and self.pool:
-                self.pool.close()
+                pools = [self.pool] + self.replica_pools
+                for pool in pools:
+                    pool.close()
                 self.closed = True
-                await self.pool.wait_closed()
+                self.replica_pools = []
+                for pool in pools:
+                    await pool.wait_closed()
 
     async def connect(self, safe=True):
         if self.deferred:
@@ -170,6 +585,11 @@ class AioDatabase(Database):
         with self.exception_wrapper:
             self.pool = await self._connect(self.database,
                                             **self.connect_kwargs)
+            for replica in self.replicas:
+                kwargs = dict(self.connect_kwargs, **replica)
+                database = kwargs.pop('database', self.database)
+                self.replica_pools.append(
+                    await self._connect(database, **kwargs))
             self.closed = False
 
     def get_result_wrapper(self, wrapper_type):
@@ -187,7 +607,49 @@ class AioDatabase(Database):
             return AioNaiveQueryResultWrapper
 
     def atomic(self, transaction_type=None):
-        return _aio_atomic(self.get_conn(), transaction_type)
+        return _aio_atomic(self, transaction_type)
+
+    async def gather(self, *aws, limit=None, return_exceptions=False):
+        """Run queries (or coroutines like ``query.count()``) concurrently.
+
+        Every one runs in its own task on its own pooled connection, at most
+        `limit` (and the pool size) at a time. The results are returned in
+        order. The first error cancels the others and is raised, unless
+        `return_exceptions` is set.
+        """
+        if self.bound_conn() is not None:
+            for aw in aws:
+                if asyncio.iscoroutine(aw):
+                    aw.close()
+            raise OperationalError('Queries cannot run concurrently inside a '
+                                   'transaction, it is bound to a single '
+                                   'connection.')
+        maxsize = getattr(self.pool, 'maxsize', None)
+        limit = min([n for n in (limit, maxsize) if n], default=None)
+        semaphore = asyncio.Semaphore(limit) if limit else None
+
+        async def run(aw):
+            if semaphore is None:
+                return await aw
+            async with semaphore:
+                return await aw
+
+        tasks = [asyncio.ensure_future(run(aw)) for aw in aws]
+        try:
+            return await asyncio.gather(*tasks,
+                                        return_exceptions=return_exceptions)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # the coroutines which never got their turn
+            for aw in aws:
+                if asyncio.iscoroutine(aw):
+                    aw.close()
+            raise
+
+    def unit_of_work(self):
+        return aio_unit_of_work(self)
 
     def transaction(self, transaction_type=None):
         return aio_transaction(self, transaction_type)
@@ -272,10 +734,14 @@ class AioDatabase(Database):
             async with self.get_conn() as conn:
                 return await conn.execute_sql(*qc.drop_sequence(seq))
 
-    async def execute_sql(self, sql, params=None, require_commit=True):
+    async def execute_sql(self, sql, params=None, require_commit=True,
+                          timeout=None):
+        if timeout is None:
+            timeout = self.timeout
         async with self.get_conn() as conn:
             return await conn.execute_sql(sql, params,
-                                          require_commit=require_commit)
+                                          require_commit=require_commit,
+                                          timeout=timeout)
 
     def extract_date(self, date_part, date_field):
         return fn.EXTRACT(Clause(date_part, R('FROM'), date_field))
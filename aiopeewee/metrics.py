@@ -0,0 +1,241 @@
+import re
+import sys
+from bisect import bisect_left
+from collections import Counter
+from functools import lru_cache
+from weakref import WeakSet
+
+from peewee import logger
+
+from .slowlog import _caller
+from .utils import current_task
+
+
+_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\b\d+(?:\.\d+)?\b|%s|\?")
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ROWS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_SPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalize a statement, so the executions of a call site match.
+
+    Comments and literals are stripped, placeholder lists (IN lists, VALUES
+    rows) are collapsed.
+    """
+    sql = _COMMENT.sub('', sql)
+    sql = _LITERAL.sub('?', sql)
+    sql = _LIST.sub('(...)', sql)
+    sql = _ROWS.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class Histogram(object):
+    """Counts of observed durations (in seconds) in exponential buckets."""
+
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+               0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+    def __init__(self):
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': [(bound, count) for bound, count
+                        in zip(self.buckets, self.counts) if count],
+        }
+
+
+class PoolMetrics(object):
+    """Connection usage collected by AioConnection when entered and left."""
+
+    def __init__(self, time_queries=False):
+        # statements are only timed on request, see AioConnection.execute_sql
+        self.time_queries = time_queries
+        self.acquire_wait = Histogram()
+        self.hold_time = Histogram()
+        self.query_time = Histogram()
+        self.waiting = 0
+        self.in_use = 0
+        self.created = 0
+        self.closed = 0
+        self._seen = WeakSet()
+
+    def acquired(self, conn, wait):
+        self.acquire_wait.observe(wait)
+        self.in_use += 1
+        if conn not in self._seen:
+            self._seen.add(conn)
+            self.created += 1
+
+    def released(self, conn, hold, query_time):
+        self.hold_time.observe(hold)
+        if self.time_queries:
+            self.query_time.observe(query_time)
+        self.in_use -= 1
+        if getattr(conn, 'closed', False):
+            # the pool drops closed connections instead of reusing them
+            self.closed += 1
+
+
+class StatementStats(object):
+    """Aggregated executions per statement fingerprint.
+
+    A client-side pg_stat_statements, collected through execution hooks
+    while started.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.statements = {}
+
+    def start(self):
+        self.database.add_hook('after_execute', self.after_execute)
+        self.database.add_hook('on_error', self.on_error)
+        return self
+
+    def stop(self):
+        self.database.remove_hook('after_execute', self.after_execute)
+        self.database.remove_hook('on_error', self.on_error)
+
+    def reset(self):
+        self.statements = {}
+
+    def _stat(self, sql):
+        key = fingerprint(sql)
+        try:
+            return self.statements[key]
+        except KeyError:
+            stat = self.statements[key] = [0, 0, 0, Histogram()]
+            return stat
+
+    def after_execute(self, sql, params, duration, rowcount, connection_id):
+        stat = self._stat(sql)
+        stat[0] += 1
+        if rowcount and rowcount > 0:
+            stat[2] += rowcount
+        stat[3].observe(duration)
+
+    def on_error(self, sql, params, duration, exc, connection_id):
+        stat = self._stat(sql)
+        stat[0] += 1
+        stat[1] += 1
+        stat[3].observe(duration)
+
+    def as_list(self):
+        """Statistics of each fingerprint, the most time consuming first."""
+        stats = []
+        for key, (calls, errors, rows, latency) in self.statements.items():
+            stats.append({
+                'fingerprint': key,
+                'calls': calls,
+                'errors': errors,
+                'rows': rows,
+                'total_time': latency.sum,
+                'mean_time': latency.sum / calls,
+                'max_time': latency.max,
+                'p95_time': latency.quantile(0.95),
+                'p99_time': latency.quantile(0.99),
+            })
+        stats.sort(key=lambda stat: stat['total_time'], reverse=True)
+        return stats
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudget(object):
+    """Counts the statements executed by the current task inside a block.
+
+    On leaving the block, reports the fingerprints executed at least
+    `warn_repeated` times (usually an N+1 query pattern) and exceeding
+    `max_queries` statements in total, along with their call sites. Reports
+    are logged as warnings or raised as QueryBudgetExceeded when `strict`.
+    """
+
+    # transaction control statements are not counted
+    skip = ('BEGIN', 'ROLLBACK', 'COMMIT', 'SAVEPOINT', 'RELEASE')
+
+    def __init__(self, database, max_queries=None, warn_repeated=5,
+                 strict=False):
+        self.database = database
+        self.max_queries = max_queries
+        self.warn_repeated = warn_repeated
+        self.strict = strict
+        self.task = None
+        self.total = 0
+        self.counts = Counter()
+        self.locations = {}
+
+    async def __aenter__(self):
+        self.task = current_task()
+        self.database.add_hook('before_execute', self.before_execute)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.database.remove_hook('before_execute', self.before_execute)
+        report = self.report()
+        if report and exc_type is None:
+            if self.strict:
+                raise QueryBudgetExceeded(report)
+            logger.warning(report)
+
+    def before_execute(self, sql, params, connection_id):
+        if current_task() is not self.task or sql.startswith(self.skip):
+            return
+        self.total += 1
+        key = fingerprint(sql)
+        self.counts[key] += 1
+        # call sites are only looked up for the offending statements
+        if ((self.warn_repeated and self.counts[key] >= self.warn_repeated) or
+                (self.max_queries and self.total > self.max_queries)):
+            location, _ = _caller(sys._getframe(1))
+            self.locations.setdefault(key, set()).add(location)
+
+    def report(self):
+        lines = []
+        if self.max_queries and self.total > self.max_queries:
+            lines.append('%d statements executed, the budget is %d' %
+                         (self.total, self.max_queries))
+        for key, count in self.counts.most_common():
+            if self.warn_repeated and count >= self.warn_repeated:
+                lines.append('%d times: %s' % (count, key))
+            elif key in self.locations:
+                lines.append('over budget: %s' % key)
+            else:
+                continue
+            for location in sorted(self.locations[key]):
+                lines.append('    at %s' % location)
+        return '\n'.join(lines)
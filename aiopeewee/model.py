@@ -1,9 +1,19 @@
-from peewee import Model, ModelAlias, IntegrityError
+from peewee import (Model, ModelAlias, IntegrityError, Passthrough, SQL,
+                    SelectQuery, basestring)
+from playhouse.shortcuts import case
 
 from .query import (AioSelectQuery, AioUpdateQuery, AioInsertQuery,
                     AioDeleteQuery, AioRawQuery, AioNoopSelectQuery)
 
 
+def _materialize(query):
+    # MySQL refuses to modify a table which is also read in a subquery of
+    # the same statement and LIMIT in IN subqueries, unless the subquery is
+    # wrapped in a derived table
+    sql, params = query.sql()
+    return SQL('(SELECT * FROM (%s) AS _materialized)' % sql, *params)
+
+
 class AioModelAlias(ModelAlias):
 
     def select(self, *selection):
@@ -54,10 +64,139 @@ class AioModel(Model):
     def insert_from(cls, fields, query):
         return AioInsertQuery(cls, fields=fields, query=query)
 
+    @classmethod
+    async def bulk_update(cls, model_list, fields=None, batch_size=None):
+        """Update many saved instances with one statement per batch.
+
+        Every batch compiles to a single
+        ``UPDATE ... SET col = CASE pk WHEN ... END WHERE pk IN (...)``.
+        Without explicit `fields` each instance contributes its own dirty
+        fields, columns not dirty on a given instance keep their value.
+        """
+        pk_field = cls._meta.primary_key
+        if pk_field is False or cls._meta.composite_key:
+            raise ValueError('bulk_update() requires a model with a single '
+                             'primary key.')
+        if fields is not None:
+            fields = [cls._meta.fields[f] if isinstance(f, basestring) else f
+                      for f in fields]
+
+        model_list = list(model_list)
+        batch_size = batch_size or len(model_list) or 1
+        rows = 0
+        for i in range(0, len(model_list), batch_size):
+            updates = {}
+            id_list = []
+            for inst in model_list[i:i + batch_size]:
+                pk_value = inst._get_pk_value()
+                if pk_value is None:
+                    raise ValueError('bulk_update() cannot be used on unsaved '
+                                     'instances: %r' % inst)
+                field_dict = dict(inst._data)
+                inst._populate_unsaved_relations(field_dict)
+                to_update = [f for f in fields or inst.dirty_fields
+                             if f is not pk_field and f.name in field_dict]
+                if not to_update:
+                    continue
+                when = Passthrough(pk_value, adapt=pk_field.db_value)
+                for field in to_update:
+                    then = Passthrough(field_dict[field.name],
+                                       adapt=field.db_value)
+                    updates.setdefault(field, []).append((when, then))
+                id_list.append(pk_value)
+            if updates:
+                update = dict((field, case(pk_field, pairs, field))
+                              for field, pairs in updates.items())
+                rows += await (cls.update(update)
+                                  .where(pk_field << id_list)
+                                  .execute())
+
+        for inst in model_list:
+            if fields is None:
+                inst._dirty.clear()
+            else:
+                inst._dirty.difference_update(f.name for f in fields)
+        return rows
+
     @classmethod
     def delete(cls):
         return AioDeleteQuery(cls)
 
+    @classmethod
+    def _dependencies(cls, query, search_nullable=False):
+        """Like ``dependencies()`` but for every row matched by `query`."""
+        stack = [(cls, query, {cls})]
+        seen = set()
+
+        while stack:
+            klass, query, models = stack.pop()
+            if klass in seen:
+                continue
+            seen.add(klass)
+            for rel_name, fk in klass._meta.reverse_rel.items():
+                rel_model = fk.model_class
+                subquery = query.select(fk.to_field)
+                if rel_model in models or query._limit or query._offset:
+                    subquery = _materialize(subquery)
+                node = fk << subquery
+                if not fk.null or search_nullable:
+                    stack.append((rel_model, rel_model.select().where(node),
+                                  models | {rel_model}))
+                yield (node, fk)
+
+    @classmethod
+    async def delete_many(cls, instances_or_query, recursive=False,
+                          delete_nullable=False):
+        """Delete many instances, or every row matched by a select query.
+
+        With `recursive` the dependency tree is computed once and each
+        dependent table is cleaned up with a single statement using subquery
+        predicates, children first, all in one transaction. A query is
+        re-evaluated by every statement, so it should not filter on the
+        dependent rows being deleted.
+
+        Rows stored by several databases (see ``AioDatabase.partition()``) are
+        deleted in a transaction per database.
+        """
+        pk_field = cls._meta.primary_key
+        if pk_field is False or cls._meta.composite_key:
+            raise ValueError('delete_many() requires a model with a single '
+                             'primary key.')
+
+        deleted = 0
+        parts = cls._meta.database.partition(cls, instances_or_query)
+        for database, part in parts:
+            deleted += await cls._delete_many(database, part, recursive,
+                                              delete_nullable)
+        return deleted
+
+    @classmethod
+    async def _delete_many(cls, database, instances_or_query, recursive,
+                           delete_nullable):
+        pk_field = cls._meta.primary_key
+        if isinstance(instances_or_query, SelectQuery):
+            query = instances_or_query
+            where = pk_field << _materialize(query.select(pk_field))
+        else:
+            id_list = [inst._get_pk_value() for inst in instances_or_query]
+            if not id_list:
+                return 0
+            where = pk_field << id_list
+            query = cls.select().where(where)
+
+        async with database.atomic():
+            if recursive:
+                dependencies = cls._dependencies(query, delete_nullable)
+                for node, fk in reversed(list(dependencies)):
+                    model = fk.model_class
+                    if fk.null and not delete_nullable:
+                        await (model.update(**{fk.name: None})
+                                    .where(node)
+                                    .execute())
+                    else:
+                        await model.delete().where(node).execute()
+            return await cls.delete().where(where).execute()
+
     @classmethod
     def raw(cls, sql, *params):
         return AioRawQuery(cls, sql, *params)
@@ -96,7 +235,8 @@ class AioModel(Model):
                               if '__' not in k)
                 params.update(defaults)
 
-                async with cls._meta.database.atomic():
+                database = cls._meta.database.database_for(cls, params)
+                async with database.atomic():
                     return await cls.create(**params), True
             except IntegrityError as exc:
                 try:
@@ -120,8 +260,8 @@ class AioModel(Model):
         db = cls._meta.database
         pk = cls._meta.primary_key
         if db.sequences and pk is not False and pk.sequence:
-            if not db.sequence_exists(pk.sequence):
-                db.create_sequence(pk.sequence)
+            if not await db.sequence_exists(pk.sequence):
+                await db.create_sequence(pk.sequence)
 
         await db.create_table(cls)
         await cls._create_indexes()
@@ -148,6 +288,9 @@ class AioModel(Model):
     def noop(cls, *args, **kwargs):
         return AioNoopSelectQuery(cls, *args, **kwargs)
 
+    def _pk_expr(self):
+        return self._meta.database.instance_expr(self, super()._pk_expr())
+
     async def save(self, force_insert=False, only=None):
         field_dict = dict(self._data)
         if self._meta.primary_key is not False:
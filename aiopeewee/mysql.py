@@ -1,6 +1,7 @@
+import asyncio
 import aiomysql
 
-from peewee import mysql, ImproperlyConfigured
+from peewee import mysql, logger, DatabaseError, ImproperlyConfigured
 from peewee import (MySQLDatabase, IndexMetadata,
                     ColumnMetadata, ForeignKeyMetadata)
 
@@ -9,6 +10,10 @@ from .database import AioDatabase
 
 class AioMySQLDatabase(AioDatabase, MySQLDatabase):
 
+    server_side_cursor = aiomysql.SSCursor
+    explain_prefix = 'EXPLAIN FORMAT=JSON'
+    system = 'mysql'
+
     async def _connect(self, database, **kwargs):
         if not mysql:
             raise ImproperlyConfigured('MySQLdb or PyMySQL must be installed.')
@@ -19,6 +24,45 @@ class AioMySQLDatabase(AioDatabase, MySQLDatabase):
         conn_kwargs.update(kwargs)
         return await aiomysql.create_pool(db=database, **conn_kwargs)
 
+    def connection_id(self, conn):
+        return conn.thread_id()
+
+    def timeout_hint(self, sql, timeout):
+        # optimizer hints are only honored in the top-level SELECT. The
+        # server limit is a backstop for when the KILL cannot get through,
+        # so give the client side a head start.
+        if sql[:7].upper() != 'SELECT ':
+            return sql
+        hint = '/*+ MAX_EXECUTION_TIME(%d) */ ' % (timeout * 1000 + 1000)
+        return sql[:7] + hint + sql[7:]
+
+    async def kill_query(self, thread_id, pool=None, timeout=5):
+        # a fresh connection, the bound one may be the connection to kill
+        async def kill():
+            async with self._new_conn(pool) as conn:
+                await conn.execute_sql('KILL QUERY %s', (thread_id,),
+                                       require_commit=False)
+
+        try:
+            await asyncio.wait_for(kill(), timeout)
+        except (asyncio.TimeoutError, DatabaseError):
+            # the query finished meanwhile or the pool is exhausted
+            logger.warning('Failed to kill query of thread %s', thread_id)
+
+    async def write_position(self, conn):
+        cursor = await conn.execute_sql('SELECT @@GLOBAL.gtid_executed',
+                                        require_commit=False)
+        gtid_set, = await cursor.fetchone()
+        # empty unless GTID based replication is enabled
+        return gtid_set or None
+
+    async def wait_for_position(self, conn, position, timeout):
+        cursor = await conn.execute_sql(
+            'SELECT WAIT_FOR_EXECUTED_GTID_SET(%s, %s)', (position, timeout),
+            require_commit=False)
+        result, = await cursor.fetchone()
+        return result == 0
+
     async def get_tables(self, schema=None):
         async with self.get_conn() as conn:
             cursor = await conn.execute_sql('SHOW TABLES')
@@ -73,5 +117,26 @@ class AioMySQLDatabase(AioDatabase, MySQLDatabase):
         return [ForeignKeyMetadata(column, dest_table, dest_column, table)
                 for column, dest_table, dest_column in rows]
 
+    async def replication_lag(self):
+        """Seconds the replicas are behind the primary, None if unknown.
+
+        The largest lag of the replicas is returned. Without replicas the
+        server of the database is asked, e.g. when it is a replica itself.
+        """
+        lags = []
+        for pool in self.replica_pools or [self.pool]:
+            async with self._new_conn(pool) as conn:
+                cursor = await conn.execute_sql('SHOW SLAVE STATUS',
+                                                require_commit=False)
+                row = await cursor.fetchone()
+            if not row:
+                return None
+            columns = [column[0] for column in cursor.description]
+            lag = dict(zip(columns, row)).get('Seconds_Behind_Master')
+            if lag is None:
+                return None
+            lags.append(lag)
+        return max(lags)
+
     def get_binary_type(self):
         return mysql.Binary
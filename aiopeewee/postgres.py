@@ -0,0 +1,367 @@
+import re
+import asyncio
+from functools import lru_cache
+from itertools import count
+from weakref import WeakKeyDictionary
+
+from peewee import logger, DatabaseError, ImproperlyConfigured
+from peewee import (IntegrityError, DataError, ProgrammingError,
+                    OperationalError, InterfaceError)
+from peewee import (PostgresqlDatabase, IndexMetadata,
+                    ColumnMetadata, ForeignKeyMetadata)
+
+from .database import AioDatabase
+
+try:
+    import aiopg
+except ImportError:
+    aiopg = None
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+
+class AioPostgresqlDatabase(AioDatabase, PostgresqlDatabase):
+    """PostgreSQL through aiopg.
+
+    Inserts return the generated keys with RETURNING, so multi-row inserts
+    with ``return_id_list()`` and the ``returning()`` variants of INSERT,
+    UPDATE and DELETE are single round trips.
+
+    aiopg connections are always in autocommit mode, transactions are
+    started with an explicit BEGIN.
+    """
+
+    explain_prefix = 'EXPLAIN (FORMAT JSON)'
+    system = 'postgresql'
+    explicit_transactions = True
+
+    async def _connect(self, database, encoding=None, **kwargs):
+        if aiopg is None:
+            raise ImproperlyConfigured('aiopg must be installed.')
+        if encoding:
+            kwargs.setdefault('client_encoding', encoding)
+        return await aiopg.create_pool(database=database, **kwargs)
+
+    def connection_id(self, conn):
+        return conn.raw.get_backend_pid()
+
+    async def kill_query(self, thread_id, pool=None, timeout=5):
+        # a fresh connection, the bound one may be the connection to cancel
+        async def kill():
+            async with self._new_conn(pool) as conn:
+                await conn.execute_sql('SELECT pg_cancel_backend(%s)',
+                                       (thread_id,), require_commit=False)
+
+        try:
+            await asyncio.wait_for(kill(), timeout)
+        except (asyncio.TimeoutError, DatabaseError):
+            logger.warning('Failed to cancel query of backend %s', thread_id)
+
+    def last_insert_id(self, cursor, model):
+        # inserts return the generated keys, CURRVAL is never needed
+        raise NotImplementedError
+
+    async def _fetchall(self, sql, params=None):
+        async with self.get_conn() as conn:
+            cursor = await conn.execute_sql(sql, params, require_commit=False)
+            return await cursor.fetchall()
+
+    async def get_tables(self, schema='public'):
+        rows = await self._fetchall(
+            'SELECT tablename FROM pg_catalog.pg_tables '
+            'WHERE schemaname = %s ORDER BY tablename', (schema,))
+        return [row for row, in rows]
+
+    async def get_indexes(self, table, schema='public'):
+        sql = """
+            SELECT
+                i.relname, idxs.indexdef, idx.indisunique,
+                array_to_string(array_agg(cols.attname), ',')
+            FROM pg_catalog.pg_class AS t
+            INNER JOIN pg_catalog.pg_index AS idx ON t.oid = idx.indrelid
+            INNER JOIN pg_catalog.pg_class AS i ON idx.indexrelid = i.oid
+            INNER JOIN pg_catalog.pg_indexes AS idxs ON
+                (idxs.tablename = t.relname AND idxs.indexname = i.relname)
+            LEFT OUTER JOIN pg_catalog.pg_attribute AS cols ON
+                (cols.attrelid = t.oid AND cols.attnum = ANY(idx.indkey))
+            WHERE t.relname = %s AND t.relkind = %s AND idxs.schemaname = %s
+            GROUP BY i.relname, idxs.indexdef, idx.indisunique
+            ORDER BY idx.indisunique DESC, i.relname;"""
+        rows = await self._fetchall(sql, (table, 'r', schema))
+        return [IndexMetadata(row[0], row[1], row[3].split(','), row[2], table)
+                for row in rows]
+
+    async def get_columns(self, table, schema='public'):
+        sql = """
+            SELECT column_name, is_nullable, data_type
+            FROM information_schema.columns
+            WHERE table_name = %s AND table_schema = %s
+            ORDER BY ordinal_position"""
+        rows = await self._fetchall(sql, (table, schema))
+        pks = set(await self.get_primary_keys(table, schema))
+        return [ColumnMetadata(name, dt, null == 'YES', name in pks, table)
+                for name, null, dt in rows]
+
+    async def get_primary_keys(self, table, schema='public'):
+        sql = """
+            SELECT kc.column_name
+            FROM information_schema.table_constraints AS tc
+            INNER JOIN information_schema.key_column_usage AS kc ON (
+                tc.table_name = kc.table_name AND
+                tc.table_schema = kc.table_schema AND
+                tc.constraint_name = kc.constraint_name)
+            WHERE
+                tc.constraint_type = %s AND
+                tc.table_name = %s AND
+                tc.table_schema = %s"""
+        rows = await self._fetchall(sql, ('PRIMARY KEY', table, schema))
+        return [row for row, in rows]
+
+    async def get_foreign_keys(self, table, schema='public'):
+        sql = """
+            SELECT
+                kcu.column_name, ccu.table_name, ccu.column_name
+            FROM information_schema.table_constraints AS tc
+            JOIN information_schema.key_column_usage AS kcu
+                ON (tc.constraint_name = kcu.constraint_name AND
+                    tc.constraint_schema = kcu.constraint_schema)
+            JOIN information_schema.constraint_column_usage AS ccu
+                ON (ccu.constraint_name = tc.constraint_name AND
+                    ccu.constraint_schema = tc.constraint_schema)
+            WHERE
+                tc.constraint_type = 'FOREIGN KEY' AND
+                tc.table_name = %s AND
+                tc.table_schema = %s"""
+        rows = await self._fetchall(sql, (table, schema))
+        return [ForeignKeyMetadata(row[0], row[1], row[2], table)
+                for row in rows]
+
+    async def sequence_exists(self, sequence):
+        rows = await self._fetchall("""
+            SELECT COUNT(*) FROM pg_class, pg_namespace
+            WHERE relkind='S'
+                AND pg_class.relnamespace = pg_namespace.oid
+                AND relname=%s""", (sequence,))
+        return bool(rows[0][0])
+
+    def set_search_path(self, *search_path):
+        # a SET would only affect one of the pooled connections
+        raise NotImplementedError('Pass options="-c search_path=..." to '
+                                  'the connection arguments instead.')
+
+
+_PLACEHOLDER = re.compile(r'%(%|s)')
+# quoted literals and identifiers, parentheses
+_TOKEN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|[()]|[^'\"()]+")
+_WORD = re.compile(r'[A-Za-z_]+')
+_VERBS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'VALUES', 'TABLE')
+
+
+def _returns_rows(sql):
+    """Whether the main statement returns rows.
+
+    Only the words outside of parentheses count, so the verb following the
+    CTEs of a WITH is found and a RETURNING of a CTE is ignored.
+    """
+    depth = 0
+    words = []
+    for token in _TOKEN.findall(sql):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif not depth and token[0] not in '\'"':
+            words.extend(word.upper() for word in _WORD.findall(token))
+    verb = next((word for word in words if word in _VERBS), None)
+    if verb in ('INSERT', 'UPDATE', 'DELETE'):
+        return 'RETURNING' in words
+    return True
+
+
+@lru_cache(maxsize=1024)
+def _native_sql(sql):
+    """Convert the %s placeholders of a compiled statement to $n.
+
+    Returns the statement and whether it returns rows, writes without a
+    RETURNING clause only report the affected row count.
+    """
+    counter = count(1)
+
+    def replace(match):
+        return '%' if match.group(1) == '%' else '$%d' % next(counter)
+
+    native = _PLACEHOLDER.sub(replace, sql)
+    return native, _returns_rows(native)
+
+
+def _database_error(exc):
+    if isinstance(exc, asyncpg.IntegrityConstraintViolationError):
+        return IntegrityError(str(exc))
+    elif isinstance(exc, asyncpg.DataError):
+        return DataError(str(exc))
+    elif isinstance(exc, asyncpg.SyntaxOrAccessError):
+        return ProgrammingError(str(exc))
+    elif isinstance(exc, asyncpg.InterfaceError):
+        return InterfaceError(str(exc))
+    return OperationalError(str(exc))
+
+
+class _AsyncpgCursor(object):
+    """Serves the fetched asyncpg records to the result wrappers.
+
+    Statements run through asyncpg's statement cache and the records are
+    handed over as they are, they support indexing like tuples.
+    """
+
+    lastrowid = None
+    name = None
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._records = []
+        self._pos = 0
+        self.rowcount = -1
+
+    @property
+    def description(self):
+        if not self._records:
+            return None
+        return [(name,) for name in self._records[0].keys()]
+
+    async def execute(self, sql, params=()):
+        sql, returns_rows = _native_sql(sql)
+        try:
+            if returns_rows:
+                self._records = await self._conn.fetch(sql, *params)
+                self.rowcount = len(self._records)
+            else:
+                status = await self._conn.execute(sql, *params)
+                count = status.rsplit(' ', 1)[-1]
+                self.rowcount = int(count) if count.isdigit() else -1
+        except (asyncpg.PostgresError, asyncpg.InterfaceError) as exc:
+            raise _database_error(exc) from exc
+        self._pos = 0
+
+    async def fetchone(self):
+        if self._pos >= len(self._records):
+            return None
+        self._pos += 1
+        return self._records[self._pos - 1]
+
+    async def fetchmany(self, size=1):
+        records = self._records[self._pos:self._pos + size]
+        self._pos += len(records)
+        return records
+
+    async def fetchall(self):
+        records = self._records[self._pos:]
+        self._pos = len(self._records)
+        return records
+
+    def close(self):
+        self._records = []
+
+
+class _AsyncpgConnection(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @property
+    def closed(self):
+        return self.conn.is_closed()
+
+    def thread_id(self):
+        return self.conn.get_server_pid()
+
+    async def cursor(self, cursor_class=None):
+        return _AsyncpgCursor(self.conn)
+
+    def close(self):
+        self.conn.terminate()
+
+
+class _AsyncpgPool(object):
+    """The asyncpg pool with the interface of the aiomysql pool."""
+
+    def __init__(self, pool):
+        self._pool = pool
+        # the same wrapper for every acquisition of a connection, so the
+        # pool metrics can tell new connections apart. acquire() returns a
+        # new proxy each time, the wrappers are looked up by the connection
+        # behind it and dropped along with it.
+        self._conns = WeakKeyDictionary()
+
+    @property
+    def size(self):
+        return self._pool.get_size()
+
+    @property
+    def freesize(self):
+        return self._pool.get_idle_size()
+
+    @property
+    def maxsize(self):
+        return self._pool.get_max_size()
+
+    async def _acquire(self):
+        proxy = await self._pool.acquire()
+        conn = proxy._con
+        wrapper = self._conns.get(conn)
+        if wrapper is None:
+            wrapper = self._conns[conn] = _AsyncpgConnection(proxy)
+        else:
+            # the proxy of a previous acquisition is detached on release
+            wrapper.conn = proxy
+        return wrapper
+
+    async def release(self, conn):
+        await self._pool.release(conn.conn)
+
+    def acquire(self):
+        return _AsyncpgAcquireContext(self)
+
+    def close(self):
+        self._conns.clear()
+
+    async def wait_closed(self):
+        await self._pool.close()
+
+
+class _AsyncpgAcquireContext(object):
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    async def __aenter__(self):
+        self._conn = await self._pool._acquire()
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        conn, self._conn = self._conn, None
+        await self._pool.release(conn)
+
+
+class AioAsyncpgDatabase(AioPostgresqlDatabase):
+    """PostgreSQL through asyncpg and its binary protocol.
+
+    The statements are prepared once per connection and kept in asyncpg's
+    statement cache (``statement_cache_size``, 100 by default), the
+    placeholders of peewee's SQL are converted once per statement. Unlike
+    psycopg2, asyncpg does not cast the parameters, so their python types
+    must match the column types.
+    """
+
+    async def _connect(self, database, minsize=1, maxsize=10, **kwargs):
+        if asyncpg is None:
+            raise ImproperlyConfigured('asyncpg must be installed.')
+        pool = await asyncpg.create_pool(database=database, min_size=minsize,
+                                         max_size=maxsize, **kwargs)
+        return _AsyncpgPool(pool)
+
+    def connection_id(self, conn):
+        return conn.thread_id()
@@ -1,10 +1,56 @@
+import re
+import json
+import time
+import base64
+import asyncio
 import operator
+from functools import reduce
+from collections import namedtuple
+from inspect import isawaitable
+from peewee import Clause, Field, Passthrough, fn
 from peewee import SQL, Query, RawQuery, SelectQuery, NoopSelectQuery
 from peewee import CompoundSelect, DeleteQuery, UpdateQuery, InsertQuery
-from peewee import _WriteQuery
+from peewee import _WriteQuery, returns_clone
 from peewee import RESULTS_TUPLES, RESULTS_DICTS, RESULTS_NAIVE
 
-from .utils import alist
+from .utils import alist, close_cursor
+
+
+ChunkProgress = namedtuple(
+    'ChunkProgress', ('chunk', 'rows', 'total_rows', 'last_key', 'elapsed'))
+
+# raw SELECTs without locking clauses may run on a replica
+_READ = re.compile(r'\s*SELECT\b(?!.*\bFOR\s+(UPDATE|SHARE)\b)', re.I | re.S)
+
+
+def _encode_seek_token(values):
+    data = json.dumps(values, default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def _decode_seek_token(token, n):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid seek token: %r' % token)
+    if not isinstance(values, list) or len(values) != n:
+        raise ValueError('Seek token does not match the ordering.')
+    return values
+
+
+def _seek_predicate(keys, values):
+    # (a > x) OR (a = x AND b > y) OR ..., with a leading range on the first
+    # key so the optimizer picks an index range scan
+    params = [Passthrough(value) for value in values]
+    expressions = []
+    for i, (key, descending) in enumerate(keys):
+        expression = key < params[i] if descending else key > params[i]
+        for (prev, _), param in zip(keys[:i], params):
+            expression &= prev == param
+        expressions.append(expression)
+    first, descending = keys[0]
+    bound = first <= params[0] if descending else first >= params[0]
+    return bound & reduce(operator.or_, expressions)
 
 
 class AioQueryResult:
@@ -26,13 +72,62 @@ class AioQueryResult:
 
 class AioQuery(Query):
 
+    _timeout = None
+    _using = None
+    _shard_key = None
+
+    def _clone_attributes(self, query):
+        query = super()._clone_attributes(query)
+        query._timeout = self._timeout
+        query._using = self._using
+        query._shard_key = self._shard_key
+        return query
+
+    @returns_clone
+    def timeout(self, seconds):
+        """Limit the execution time, overrides the database's default."""
+        self._timeout = seconds
+
+    @returns_clone
+    def using(self, target):
+        """Run a read on the 'primary' (to see fresh data) or a 'replica'."""
+        if target not in ('primary', 'replica'):
+            raise ValueError('Unknown target "%s"' % target)
+        self._using = target
+
+    @returns_clone
+    def shard(self, key):
+        """Run on the shard of `key`, see ShardedAioDatabase."""
+        self._shard_key = key
+
+    def _is_read(self):
+        return False
+
+    def _get_conn(self):
+        read_only = self._using != 'primary' and self._is_read()
+        return self.database.get_conn(read_only=read_only, query=self)
+
+    def _sql_with_timeout(self):
+        sql, params = self.sql()
+        timeout = self._timeout
+        if timeout is None:
+            timeout = self.database.timeout
+        if timeout:
+            sql = self.database.timeout_hint(sql, timeout)
+        return sql, params, timeout
+
     async def execute(self):
         raise NotImplementedError
 
     async def _execute(self):
-        sql, params = self.sql()
-        async with self.database.get_conn() as conn:
-            return await conn.execute_sql(sql, params, self.require_commit)
+        sql, params, timeout = self._sql_with_timeout()
+        with self.database.span('db.query', sql) as span:
+            async with self._get_conn() as conn:
+                cursor = await conn.execute_sql(sql, params,
+                                                self.require_commit,
+                                                timeout=timeout)
+            span.set_attribute('db.rowcount', cursor.rowcount)
+        return cursor
 
     async def scalar(self, as_tuple=False, convert=False):
         if convert:
@@ -46,7 +141,14 @@ class AioQuery(Query):
             return row
 
     def __await__(self):
-        return alist(self).__await__()
+        return self._fetchall().__await__()
+
+    async def _fetchall(self):
+        qr = await self.execute()
+        with self.database.span('db.fetch') as span:
+            rows = await alist(qr)
+            span.set_attribute('db.response.returned_rows', len(rows))
+        return rows
 
     def __iter__(self):
         raise NotImplementedError()
@@ -61,8 +163,14 @@ class AioRawQuery(AioQuery, RawQuery):
         query = AioRawQuery(self.model_class, self._sql, *self._params)
         query._tuples = self._tuples
         query._dicts = self._dicts
+        query._timeout = self._timeout
+        query._using = self._using
+        query._shard_key = self._shard_key
         return query
 
+    def _is_read(self):
+        return _READ.match(self._sql) is not None
+
     async def execute(self):
         if self._qr is None:
             if self._tuples:
@@ -77,6 +185,9 @@ class AioRawQuery(AioQuery, RawQuery):
 
 class AioSelectQuery(AioQuery, SelectQuery):
 
+    def _is_read(self):
+        return not self._for_update
+
     def compound_op(operator):
         def inner(self, other):
             supported_ops = self.model_class._meta.database.compound_operations
@@ -104,6 +215,9 @@ class AioSelectQuery(AioQuery, SelectQuery):
         sql, params = clone.sql()
         wrapped = 'SELECT COUNT(1) FROM (%s) AS wrapped_select' % sql
         rq = self.model_class.raw(wrapped, *params)
+        rq._timeout = self._timeout
+        rq._using = self._using
+        rq._shard_key = self._shard_key
         return await rq.scalar() or 0
 
     async def exists(self):
@@ -137,6 +251,79 @@ class AioSelectQuery(AioQuery, SelectQuery):
     def sql(self):
         return self.compiler().generate_select(self)
 
+    def _seek_keys(self, order_by):
+        keys = []
+        for node in order_by:
+            key = node.clone()
+            key._ordering = None
+            keys.append((key, (node._ordering or '').upper() == 'DESC'))
+
+        # the primary key breaks ties, so that the ordering is total
+        meta = self.model_class._meta
+        if meta.primary_key is not False:
+            if meta.composite_key:
+                pk_fields = [meta.fields[name]
+                             for name in meta.primary_key.field_names]
+            else:
+                pk_fields = [meta.primary_key]
+            for pk_field in pk_fields:
+                for key, _ in keys:
+                    if (isinstance(key, Field) and
+                            key.model_class is pk_field.model_class and
+                            key.name == pk_field.name):
+                        break
+                else:
+                    keys.append((pk_field, False))
+        if not keys:
+            raise ValueError('seek() requires an ordering.')
+        return keys
+
+    async def seek(self, after=None, order_by=None, limit=20):
+        """Keyset pagination, returns a ``(rows, token)`` pair.
+
+        Instead of an OFFSET the next page starts right after the ordering
+        key of the last row, which is encoded into the opaque `token` (None
+        on the last page). Pass it back as `after` to fetch the next page.
+        The ordering defaults to the query's own, the primary key is always
+        appended as a tie-breaker. Ordering keys must not be NULL.
+        """
+        keys = self._seek_keys(order_by or self._order_by or ())
+        ordering = [key.desc() if descending else key.asc()
+                    for key, descending in keys]
+        aliases = ['_seek%d' % i for i in range(len(keys))]
+
+        query = self.clone()
+        query._select = query._select + [
+            Clause(key).alias(alias) for (key, _), alias in zip(keys, aliases)]
+        query = query.order_by(*ordering).limit(limit + 1).offset(None)
+        if after is not None:
+            values = _decode_seek_token(after, len(keys))
+            query = query.where(_seek_predicate(keys, values))
+
+        rows = await query
+        token = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            if isinstance(last, dict):
+                values = [last[alias] for alias in aliases]
+            elif isinstance(last, tuple):
+                values = list(last[-len(aliases):])
+            else:
+                values = [getattr(last, alias) for alias in aliases]
+            token = _encode_seek_token(values)
+
+        for i, row in enumerate(rows):
+            if isinstance(row, dict):
+                for alias in aliases:
+                    del row[alias]
+            elif isinstance(row, tuple):
+                rows[i] = row[:-len(aliases)]
+            else:
+                for alias in aliases:
+                    delattr(row, alias)
+        return rows, token
+
     async def execute(self):
         if self._dirty or self._qr is None:
             model_class = self.model_class
@@ -154,6 +341,108 @@ class AioSelectQuery(AioQuery, SelectQuery):
         async for row in qr.iterator():
             yield row
 
+    async def batches(self, n=1000, server_side=False):
+        """Iterate over the rows in lists of (at most) `n`.
+
+        Rows are processed according to the result mode (models, tuples or
+        dicts). With `server_side` an unbuffered cursor streams the result,
+        holding the connection until the iteration finishes.
+        """
+        cursor_class = None
+        if server_side:
+            cursor_class = self.database.server_side_cursor
+            if cursor_class is None:
+                raise NotImplementedError('Server-side cursors are not '
+                                          'supported by your database.')
+
+        sql, params, timeout = self._sql_with_timeout()
+        ResultWrapper = self._get_result_wrapper()
+        async with self._get_conn() as conn:
+            cursor = await conn.execute_sql(sql, params, self.require_commit,
+                                            cursor_class=cursor_class,
+                                            timeout=timeout)
+            qr = ResultWrapper(self.model_class, cursor, self.get_query_meta())
+            try:
+                async for batch in qr.batches(n):
+                    yield batch
+            finally:
+                if server_side and not qr._populated:
+                    # the unread rows are still pending on the connection
+                    if conn.transaction_depth():
+                        await close_cursor(cursor)
+                    else:
+                        conn.conn.close()
+                elif not qr._populated:
+                    await close_cursor(cursor)
+
+    async def parallel_scan(self, partitions=4, key=None, ordered=False,
+                            buffer=1000):
+        """Iterate over the rows scanning integer key ranges concurrently.
+
+        The ``[min, max]`` range of `key` (the primary key by default) is
+        split into `partitions` slices, each selected on its own pooled
+        connection. Rows are yielded as they arrive, or ordered by `key` when
+        `ordered` is set. The slices are read in batches of `buffer` rows,
+        through unbuffered cursors where the database supports them, and at
+        most `buffer` rows per queue wait for the consumer.
+        """
+        if self._limit is not None or self._offset:
+            raise ValueError('Cannot scan a query with LIMIT or OFFSET.')
+        key = key or self.model_class._meta.primary_key
+        bounds = self.select(fn.Min(key), fn.Max(key)).order_by()
+        low, high = await bounds.scalar(as_tuple=True)
+        if low is None:
+            return
+
+        step = (high - low) // partitions + 1
+        slices = []
+        for start in range(low, high + 1, step):
+            query = self.where((key >= start) & (key < start + step))
+            slices.append(query.order_by(key) if ordered else query)
+
+        done = object()
+
+        server_side = self.database.server_side_cursor is not None
+
+        async def scan(query, queue):
+            batches = query.batches(buffer, server_side)
+            try:
+                async for batch in batches:
+                    for row in batch:
+                        await queue.put(row)
+            except Exception as exc:
+                await queue.put(exc)
+            else:
+                await queue.put(done)
+            finally:
+                # a cancelled scan releases its connection (and unbuffered
+                # cursor) now, not when the generator is garbage collected
+                await batches.aclose()
+
+        if ordered:
+            queues = [asyncio.Queue(buffer) for _ in slices]
+            streams = [(queue, 1) for queue in queues]
+        else:
+            queues = [asyncio.Queue(buffer)] * len(slices)
+            streams = [(queues[0], len(slices))]
+
+        tasks = [asyncio.ensure_future(scan(query, queue))
+                 for query, queue in zip(slices, queues)]
+        try:
+            for queue, pending in streams:
+                while pending:
+                    row = await queue.get()
+                    if row is done:
+                        pending -= 1
+                    elif isinstance(row, Exception):
+                        raise row
+                    else:
+                        yield row
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
     def __getitem__(self, value):
         raise NotImplementedError()
 
@@ -187,7 +476,62 @@ class _AioWriteQuery(AioQuery, _WriteQuery):
         return self.execute().__await__()
 
 
-class AioUpdateQuery(_AioWriteQuery, UpdateQuery):
+class _AioChunkedWriteQuery(_AioWriteQuery):
+
+    async def execute_in_chunks(self, batch_size=1000, pause=None, rate=None,
+                                throttle=None):
+        """Execute the query over primary key ranges of `batch_size` rows.
+
+        Every chunk is a separate, separately committed statement, so locks
+        are held briefly. A `ChunkProgress` is yielded after each chunk.
+        Between chunks sleeps `pause` seconds, keeps the average below `rate`
+        rows per second and awaits ``throttle(progress)`` if given, e.g. to
+        wait until ``db.replication_lag()`` drops.
+        """
+        model = self.model_class
+        pk = model._meta.primary_key
+        if pk is False or model._meta.composite_key:
+            raise ValueError('Chunked execution requires a model with a '
+                             'single primary key.')
+
+        start = time.monotonic()
+        lower, chunk, total = None, 0, 0
+        while True:
+            bounds = model.select(pk).order_by(pk)
+            if self._where is not None:
+                bounds = bounds.where(self._where)
+            if lower is not None:
+                bounds = bounds.where(pk > lower)
+            upper = await bounds.limit(1).offset(batch_size - 1).scalar()
+
+            query = self.clone()
+            if lower is not None:
+                query = query.where(pk > lower)
+            if upper is not None:
+                query = query.where(pk <= upper)
+            rows = self.database.rows_affected(await query._execute())
+
+            chunk += 1
+            total += rows
+            elapsed = time.monotonic() - start
+            yield ChunkProgress(chunk, rows, total, upper, elapsed)
+            if upper is None:
+                break
+            lower = upper
+
+            delay = pause or 0
+            if rate:
+                delay = max(delay, total / rate - elapsed)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if throttle is not None:
+                result = throttle(ChunkProgress(chunk, rows, total, upper,
+                                                time.monotonic() - start))
+                if isawaitable(result):
+                    await result
+
+
+class AioUpdateQuery(_AioChunkedWriteQuery, UpdateQuery):
 
     async def execute(self):
         if self._returning is not None and self._qr is None:
@@ -256,7 +600,7 @@ class AioInsertQuery(_AioWriteQuery, InsertQuery):
                 return True
 
 
-class AioDeleteQuery(_AioWriteQuery, DeleteQuery):
+class AioDeleteQuery(_AioChunkedWriteQuery, DeleteQuery):
 
     async def execute(self):
         if self._returning is not None and self._qr is None:
@@ -1,3 +1,4 @@
+import asyncio
 from collections import OrderedDict
 
 from peewee import QueryResultWrapper, ExtQueryResultWrapper
@@ -5,7 +6,7 @@ from peewee import TuplesQueryResultWrapper, DictQueryResultWrapper
 from peewee import ModelQueryResultWrapper, AggregateQueryResultWrapper
 from peewee import NaiveQueryResultWrapper
 
-from .utils import AsyncIterWrapper, alist
+from .utils import AsyncIterWrapper, alist, close_cursor
 
 
 class AioResultIterator(object):
@@ -51,7 +52,7 @@ class AioQueryResultWrapper(QueryResultWrapper):
         if not row:
             self._populated = True
             if not getattr(self.cursor, 'name', None):
-                await self.cursor.close()
+                await close_cursor(self.cursor)
             raise StopAsyncIteration
         elif not self._initialized:
             self.initialize(self.cursor.description)
@@ -65,6 +66,28 @@ class AioQueryResultWrapper(QueryResultWrapper):
             except StopAsyncIteration:
                 break
 
+    async def batches(self, n):
+        # rows are read with fetchmany, the next batch is fetched while the
+        # consumer works on the current one, the result cache is bypassed
+        fetch = asyncio.ensure_future(self.cursor.fetchmany(n))
+        try:
+            while True:
+                rows = await fetch
+                if not rows:
+                    break
+                fetch = asyncio.ensure_future(self.cursor.fetchmany(n))
+                if not self._initialized:
+                    self.initialize(self.cursor.description)
+                    self._initialized = True
+                yield [self.process_row(row) for row in rows]
+        finally:
+            if not fetch.done():
+                await asyncio.wait([fetch])
+
+        self._populated = True
+        if not getattr(self.cursor, 'name', None):
+            await close_cursor(self.cursor)
+
     async def __anext__(self):
         if self._idx < self._ct:
             inst = self._result_cache[self._idx]
@@ -86,11 +109,13 @@ class AioQueryResultWrapper(QueryResultWrapper):
         if n < 0:
             raise ValueError('Negative values are not supported.')
         self._idx = self._ct
-        while not self._populated and (n > self._ct):
-            try:
-                await self.__anext__()
-            except StopAsyncIteration:
-                break
+        with self.model._meta.database.span('db.fetch') as span:
+            while not self._populated and (n > self._ct):
+                try:
+                    await self.__anext__()
+                except StopAsyncIteration:
+                    break
+            span.set_attribute('db.response.returned_rows', self._ct)
 
 
 class AioExtQueryResultWrapper(AioQueryResultWrapper,
@@ -121,6 +146,18 @@ class AioModelQueryResultWrapper(AioQueryResultWrapper,
 class AioAggregateQueryResultWrapper(AioModelQueryResultWrapper,
                                      AggregateQueryResultWrapper):
 
+    async def batches(self, n):
+        # an instance may span several rows, so batches are built from
+        # aggregated instances instead of raw fetchmany() chunks
+        batch = []
+        async for instance in self.iterator():
+            batch.append(instance)
+            if len(batch) == n:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
     async def iterate(self):
         if self._row:
             row = self._row.pop()
@@ -130,7 +167,7 @@ class AioAggregateQueryResultWrapper(AioModelQueryResultWrapper,
         if not row:
             self._populated = True
             if not getattr(self.cursor, 'name', None):
-                await self.cursor.close()
+                await close_cursor(self.cursor)
             raise StopAsyncIteration
         elif not self._initialized:
             self.initialize(self.cursor.description)
@@ -0,0 +1,411 @@
+import zlib
+import asyncio
+from bisect import bisect_right
+from collections import OrderedDict
+
+from peewee import Expression, Field, Func, Node, OP, SelectQuery
+
+from .query import AioSelectQuery, AioInsertQuery, AioUpdateQuery
+
+
+# aggregates of the shards' partial results which can be combined
+_AGGREGATES = {
+    'COUNT': sum,
+    'SUM': sum,
+    'MIN': min,
+    'MAX': max,
+}
+
+
+class HashMapping(object):
+    """Maps a key to one of `n` shards by the CRC32 of its string form."""
+
+    def __init__(self, n):
+        self.n = n
+
+    def __call__(self, key):
+        return zlib.crc32(str(key).encode('utf-8')) % self.n
+
+
+class RangeMapping(object):
+    """Maps a key to a shard by ranges.
+
+    `bounds` are the lowest keys of the second, third... shard, e.g. with
+    ``[1000, 2000]`` keys below 1000 belong to the first shard.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = sorted(bounds)
+
+    def __call__(self, key):
+        return bisect_right(self.bounds, key)
+
+
+class _MergedCursor(object):
+    """Serves the merged rows of the shards to the result wrappers."""
+
+    lastrowid = None
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.rowcount = len(rows)
+        self._rows = rows
+        self._pos = 0
+
+    async def fetchone(self):
+        if self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    async def fetchmany(self, size=1):
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    async def fetchall(self):
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
+
+    async def close(self):
+        pass
+
+
+def _same_node(a, b):
+    if a is b:
+        return True
+    alias = getattr(a, '_alias', None)
+    if alias and alias == getattr(b, '_alias', None):
+        return True
+    return (isinstance(a, Field) and isinstance(b, Field) and
+            a.model_class is b.model_class and a.name == b.name)
+
+
+def _aggregate(node):
+    """The function combining the shards' results of an aggregate."""
+    name = node.name.upper()
+    if name not in _AGGREGATES or any(
+            isinstance(arg, Func) and arg.name.upper() == 'DISTINCT'
+            for arg in node.arguments):
+        raise NotImplementedError('%s cannot be combined across shards' %
+                                  name)
+    return _AGGREGATES[name]
+
+
+class _ScatterConnection(object):
+    """Runs a select on several shards concurrently and merges the rows.
+
+    ORDER BY is applied to the merged rows, so the ordering expressions must
+    be selected. LIMIT and OFFSET are applied after merging, each shard
+    returns up to ``offset + limit`` rows. DISTINCT rows are deduplicated.
+    Aggregates are combined when they are COUNT, SUM, MIN or MAX, per group
+    with GROUP BY, whose expressions must be selected too. HAVING is not
+    supported.
+    """
+
+    def __init__(self, shards, query, read_only):
+        self.shards = shards
+        self.query = query
+        self.read_only = read_only
+        # indexes of the grouping columns and of the combined aggregates
+        self.groups = None
+        self.aggregates = []
+        self.order = []
+
+        selected = query._select
+        if query._having is not None:
+            raise NotImplementedError('HAVING cannot be applied across '
+                                      'shards')
+        if query._distinct not in (True, False):
+            raise NotImplementedError('DISTINCT ON cannot be applied across '
+                                      'shards')
+        self.distinct = query._distinct
+        if query._group_by:
+            self.groups = []
+            for i, node in enumerate(selected):
+                if any(_same_node(node, group) for group in query._group_by):
+                    self.groups.append(i)
+                elif isinstance(node, Func):
+                    self.aggregates.append((i, _aggregate(node)))
+                else:
+                    raise ValueError('Cross-shard queries can only select '
+                                     'grouped columns and aggregates: %s' %
+                                     (node,))
+            for group in query._group_by:
+                if not any(_same_node(group, node) for node in selected):
+                    raise ValueError('Cross-shard queries can only be grouped '
+                                     'by selected columns: %s' % (group,))
+        elif all(isinstance(node, Func) for node in selected):
+            self.groups = []
+            self.aggregates = [(i, _aggregate(node))
+                               for i, node in enumerate(selected)]
+
+        for node in query._order_by or ():
+            for i, column in enumerate(selected):
+                if _same_node(node, column):
+                    break
+            else:
+                raise ValueError('Cross-shard queries can only be ordered '
+                                 'by selected columns: %s' % (node,))
+            self.order.append((i, getattr(node, '_ordering', None) == 'DESC'))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def transaction_depth(self):
+        return 0
+
+    async def _run(self, shard, sql, params, require_commit, timeout):
+        async with shard.get_conn(read_only=self.read_only) as conn:
+            cursor = await conn.execute_sql(sql, params, require_commit,
+                                            timeout=timeout)
+            return cursor.description, await cursor.fetchall()
+
+    async def execute_sql(self, sql, params=None, require_commit=True,
+                          cursor_class=None, timeout=None):
+        if cursor_class is not None:
+            raise NotImplementedError('Server-side cursors are not supported '
+                                      'by cross-shard queries.')
+        query = self.query
+        limit, offset = query._limit, query._offset or 0
+        if offset or limit is not None:
+            clone = query.clone()
+            clone._offset = None
+            if limit is not None and not self.groups:
+                clone._limit = offset + limit
+            else:
+                # a group may be completed by the rows of any shard
+                clone._limit = None
+            sql, params, _ = clone._sql_with_timeout()
+
+        results = await asyncio.gather(*[
+            self._run(shard, sql, params, require_commit, timeout)
+            for shard in self.shards])
+
+        description = next((desc for desc, _ in results if desc), None)
+        rows = [tuple(row) for _, shard_rows in results for row in shard_rows]
+        if self.groups is not None:
+            rows = self._combine(rows)
+        elif self.distinct:
+            rows = list(OrderedDict.fromkeys(rows))
+        # stable sorts from the least significant ordering expression
+        for i, desc in reversed(self.order):
+            rows.sort(key=lambda row: (row[i] is not None, row[i]),
+                      reverse=desc)
+        if limit is not None:
+            rows = rows[offset:offset + limit]
+        elif offset:
+            rows = rows[offset:]
+        return _MergedCursor(description, rows)
+
+    def _combine(self, rows):
+        merged = OrderedDict()
+        for row in rows:
+            key = tuple(row[i] for i in self.groups)
+            current = merged.get(key)
+            if current is None:
+                merged[key] = list(row)
+                continue
+            for i, combine in self.aggregates:
+                values = [value for value in (current[i], row[i])
+                          if value is not None]
+                current[i] = combine(values) if values else None
+        return [tuple(row) for row in merged.values()]
+
+
+def _broadcast(name):
+    async def method(self, *args, **kwargs):
+        return await asyncio.gather(*[getattr(shard, name)(*args, **kwargs)
+                                      for shard in self.shards])
+    method.__name__ = name
+    return method
+
+
+class ShardedAioDatabase(object):
+    """Routes the queries of its models to shards by the value of a field.
+
+    `shards` are databases of the same kind, each with its own pool. The
+    shard of a query is looked up by the value of the `key` field, taken
+    from an explicit ``query.shard(value)``, the equality (or IN) conditions
+    of the where clause, or the inserted rows. `mapping` turns a key into
+    the index of its shard, by default a HashMapping.
+
+    Selects without a shard key scatter to every shard and merge the rows,
+    writes without a key are refused. Updates are routed by their where
+    clause only and cannot move rows to another shard. Queries without a key
+    inside of a shard's transaction (``db.shard_for(key).atomic()``) run on
+    that shard, and so do nested ``atomic()`` blocks. Everything else is
+    delegated to the first shard.
+    """
+
+    def __init__(self, shards, key, mapping=None):
+        self.shards = list(shards)
+        self.key = key
+        self.mapping = mapping or HashMapping(len(self.shards))
+
+    def __getattr__(self, attr):
+        # the compiler, the feature flags etc. of the underlying databases
+        if attr == 'shards':
+            raise AttributeError(attr)
+        return getattr(self.shards[0], attr)
+
+    def shard_for(self, key, model_class=None):
+        """The shard of `key`.
+
+        Keys are mapped by their database value, e.g. the hex string of a
+        UUID. Pass `model_class` to convert `key` with its key field.
+        """
+        if model_class is not None:
+            field = model_class._meta.fields.get(self.key)
+            if field is not None:
+                key = field.db_value(key)
+        return self.shards[self.mapping(key)]
+
+    async def connect(self, safe=True):
+        await asyncio.gather(*[shard.connect(safe) for shard in self.shards])
+
+    async def close(self):
+        await asyncio.gather(*[shard.close() for shard in self.shards])
+
+    create_table = _broadcast('create_table')
+    create_index = _broadcast('create_index')
+    create_foreign_key = _broadcast('create_foreign_key')
+    create_sequence = _broadcast('create_sequence')
+    drop_table = _broadcast('drop_table')
+    drop_index = _broadcast('drop_index')
+    drop_sequence = _broadcast('drop_sequence')
+    truncate_table = _broadcast('truncate_table')
+
+    def add_hook(self, event, hook):
+        for shard in self.shards:
+            shard.add_hook(event, hook)
+        return hook
+
+    def remove_hook(self, event, hook):
+        for shard in self.shards:
+            shard.remove_hook(event, hook)
+
+    def _unsharded(self, *args, **kwargs):
+        raise NotImplementedError('Use the database of a shard, '
+                                  'e.g. db.shard_for(key).atomic()')
+
+    transaction = unit_of_work = execute_sql = _unsharded
+
+    def atomic(self, *args, **kwargs):
+        shard = self._bound_shard()
+        if shard is None:
+            self._unsharded()
+        return shard.atomic(*args, **kwargs)
+
+    def _bound_shard(self):
+        for shard in self.shards:
+            if shard.bound_conn() is not None:
+                return shard
+        return None
+
+    def instance_expr(self, instance, expr):
+        # save() and delete_instance() reach the shard of the instance
+        field = instance._meta.fields.get(self.key)
+        if field is None or field is instance._meta.primary_key:
+            return expr
+        # _data holds the raw value, also of a foreign key
+        return expr & (field == instance._data.get(field.name))
+
+    def database_for(self, model_class, data):
+        field = model_class._meta.fields.get(self.key)
+        if field is not None and field.name in data:
+            return self.shard_for(data[field.name], model_class)
+        return self
+
+    def partition(self, model_class, instances_or_query):
+        shard = self._bound_shard()
+        if shard is not None:
+            return [(shard, instances_or_query)]
+        field = model_class._meta.fields.get(self.key)
+        if isinstance(instances_or_query, SelectQuery) or field is None:
+            query = instances_or_query
+            if not isinstance(query, SelectQuery):
+                pk_field = model_class._meta.primary_key
+                query = model_class.select().where(
+                    pk_field << [inst._get_pk_value() for inst in query])
+            return [(shard, query) for shard in self._route(query)]
+        parts = OrderedDict()
+        for inst in instances_or_query:
+            shard = self.shard_for(inst._data.get(field.name), model_class)
+            parts.setdefault(shard, []).append(inst)
+        return list(parts.items())
+
+    def _where_keys(self, node, field):
+        if not isinstance(node, Expression):
+            return None
+        if node.op == OP.AND:
+            return (self._where_keys(node.lhs, field) or
+                    self._where_keys(node.rhs, field))
+        if not (isinstance(node.lhs, Field) and _same_node(node.lhs, field)):
+            return None
+        if node.op == OP.EQ and not isinstance(node.rhs, Node):
+            return [node.rhs]
+        if node.op == OP.IN and isinstance(node.rhs, (list, tuple, set)):
+            return list(node.rhs)
+        return None
+
+    def _query_keys(self, query):
+        field = query.model_class._meta.fields.get(self.key)
+        if field is None:
+            return None
+        if isinstance(query, AioInsertQuery):
+            if not isinstance(query._rows, (list, tuple)):
+                query._rows = list(query._rows)
+            keys = []
+            for row in query._rows:
+                if field in row:
+                    keys.append(row[field])
+                elif field.name in row:
+                    keys.append(row[field.name])
+                else:
+                    return None
+        else:
+            keys = self._where_keys(query._where, field)
+        if keys is not None:
+            # mapped by their database value, like the stored keys
+            keys = [field.db_value(key) for key in keys]
+        return keys
+
+    def _route(self, query):
+        shards = self._find_shards(query)
+        if isinstance(query, AioUpdateQuery):
+            field = query.model_class._meta.fields.get(self.key)
+            value = query._update.get(field)
+            if value is not None and (
+                    isinstance(value, Node) or
+                    [self.shard_for(value, query.model_class)] != shards):
+                raise ValueError('Updating the %s field cannot move rows to '
+                                 'another shard' % self.key)
+        return shards
+
+    def _find_shards(self, query):
+        if query._shard_key is not None:
+            return [self.shard_for(query._shard_key, query.model_class)]
+        keys = self._query_keys(query)
+        if keys is not None:
+            indexes = sorted(set(self.mapping(key) for key in keys))
+            return [self.shards[i] for i in indexes]
+        shard = self._bound_shard()
+        if shard is not None:
+            return [shard]
+        return self.shards
+
+    def get_conn(self, read_only=False, query=None):
+        if query is None:
+            self._unsharded()
+        shards = self._route(query)
+        if len(shards) == 1:
+            return shards[0].get_conn(read_only=read_only, query=query)
+        if not isinstance(query, AioSelectQuery):
+            raise ValueError('%s needs a shard key, set the %s field or use '
+                             '.shard(key)' % (type(query).__name__, self.key))
+        return _ScatterConnection(shards, query, read_only)
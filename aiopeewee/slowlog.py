@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+from collections import deque
+
+from peewee import Query, DatabaseError, logger
+
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_SKIP_DIRS = (_PACKAGE_DIR, os.path.dirname(asyncio.__file__))
+
+
+def _caller(frame):
+    """Find the first frame outside of aiopeewee and asyncio.
+
+    Returns the location of that frame and the query being executed, if one
+    of the skipped aiopeewee frames is a query method.
+    """
+    query = None
+    while frame is not None:
+        code = frame.f_code
+        dirname = os.path.dirname(os.path.abspath(code.co_filename))
+        if dirname not in _SKIP_DIRS and \
+                not code.co_filename.endswith('peewee.py'):
+            location = '%s:%d in %s' % (code.co_filename, frame.f_lineno,
+                                        code.co_name)
+            return location, query
+        if query is None:
+            obj = frame.f_locals.get('self')
+            if isinstance(obj, Query):
+                query = '%s(%s)' % (type(obj).__name__,
+                                    obj.model_class.__name__)
+        frame = frame.f_back
+    return None, query
+
+
+class SlowQueryLog(object):
+    """Records statements running longer than `threshold` seconds.
+
+    The last `size` entries are kept in memory, and appended as JSON lines to
+    `path` when given. A sample (`explain_rate`) of the slow SELECTs are
+    explained on a separate connection.
+    """
+
+    def __init__(self, database, threshold=1.0, size=100, explain_rate=1.0,
+                 path=None):
+        self.database = database
+        self.threshold = threshold
+        self.explain_rate = explain_rate
+        self.entries = deque(maxlen=size)
+        self.stream = open(path, 'a') if path else None
+        self._pending = set()
+
+    def start(self):
+        self.database.add_hook('after_execute', self.after_execute)
+        self.database.add_hook('on_error', self.on_error)
+        return self
+
+    async def stop(self):
+        """Detach from the database and wait for the pending EXPLAINs."""
+        self.database.remove_hook('after_execute', self.after_execute)
+        self.database.remove_hook('on_error', self.on_error)
+        if self._pending:
+            await asyncio.wait(self._pending)
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def after_execute(self, sql, params, duration, rowcount, connection_id):
+        if duration >= self.threshold:
+            self.record(sql, params, duration, connection_id)
+
+    def on_error(self, sql, params, duration, exc, connection_id):
+        if duration >= self.threshold:
+            self.record(sql, params, duration, connection_id, error=exc)
+
+    def record(self, sql, params, duration, connection_id, error=None):
+        if sql.startswith(self.database.explain_prefix):
+            # our own EXPLAINs
+            return
+        location, query = _caller(sys._getframe(1))
+        entry = {
+            'timestamp': time.time(),
+            'sql': sql,
+            'params': list(params or ()),
+            'duration': duration,
+            'connection_id': connection_id,
+            'location': location,
+            'query': query,
+            'error': repr(error) if error is not None else None,
+            'plan': None,
+        }
+        self.entries.append(entry)
+
+        if (error is None and sql.lstrip()[:6].upper() == 'SELECT' and
+                random.random() < self.explain_rate):
+            task = asyncio.ensure_future(self.explain(entry))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+        else:
+            self.write(entry)
+
+    async def explain(self, entry):
+        sql = '%s %s' % (self.database.explain_prefix, entry['sql'])
+        try:
+            # not the task's connection, it may be inside a transaction
+            async with self.database._new_conn() as conn:
+                cursor = await conn.execute_sql(sql, entry['params'],
+                                                require_commit=False)
+                rows = await cursor.fetchall()
+        except DatabaseError as exc:
+            logger.warning('Failed to explain slow query: %s', exc)
+        else:
+            plan = [list(row) for row in rows]
+            if len(rows) == 1 and len(rows[0]) == 1:
+                plan = rows[0][0]
+                if isinstance(plan, str):
+                    try:
+                        plan = json.loads(plan)
+                    except ValueError:
+                        pass
+            entry['plan'] = plan
+        self.write(entry)
+
+    def write(self, entry):
+        if self.stream is not None:
+            self.stream.write(json.dumps(entry, default=str) + '\n')
+            self.stream.flush()
@@ -0,0 +1,274 @@
+import asyncio
+import sqlite3
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from peewee import (SqliteDatabase, IndexMetadata, ColumnMetadata,
+                    ForeignKeyMetadata, OperationalError, SENTINEL)
+
+from .database import AioDatabase
+
+
+class _SqliteCursor(object):
+    """Awaitable facade of a sqlite3 cursor, run on the connection's thread."""
+
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    async def execute(self, sql, params=()):
+        await self._conn._run(self._cursor.execute, sql, params)
+
+    async def fetchone(self):
+        return await self._conn._run(self._cursor.fetchone)
+
+    async def fetchmany(self, size=None):
+        size = size or self._cursor.arraysize
+        return await self._conn._run(self._cursor.fetchmany, size)
+
+    async def fetchall(self):
+        return await self._conn._run(self._cursor.fetchall)
+
+    async def close(self):
+        await self._conn._run(self._cursor.close)
+
+
+class _SqliteConnection(object):
+    """A sqlite3 connection owned by a single worker thread.
+
+    sqlite3 objects can only be used from the thread that created them, so
+    every call is submitted to the connection's own single thread executor.
+    """
+
+    def __init__(self, database, **kwargs):
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._database = database
+        self._kwargs = kwargs
+        self._conn = None
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def connect(self, init=None):
+        self._conn = await self._run(
+            partial(sqlite3.connect, self._database, **self._kwargs))
+        if init is not None:
+            await self._run(init, self._conn)
+        return self
+
+    @property
+    def closed(self):
+        return self._conn is None
+
+    def thread_id(self):
+        return id(self)
+
+    async def cursor(self, cursor_class=None):
+        return _SqliteCursor(self, await self._run(self._conn.cursor))
+
+    async def commit(self):
+        await self._run(self._conn.commit)
+
+    async def rollback(self):
+        await self._run(self._conn.rollback)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        # interrupt() is thread safe, it aborts a statement being executed
+        conn.interrupt()
+        self._executor.submit(conn.close)
+        self._executor.shutdown(wait=False)
+
+
+class _SqlitePool(object):
+    """Minimal connection pool with the interface of the aiomysql pool."""
+
+    def __init__(self, database, minsize=1, maxsize=10, init=None, **kwargs):
+        self._database = database
+        self._kwargs = kwargs
+        self._init = init
+        self._free = deque()
+        self._used = set()
+        self._cond = None
+        self._closed = False
+        self.minsize = minsize
+        self.maxsize = maxsize
+
+    @property
+    def size(self):
+        return len(self._free) + len(self._used)
+
+    @property
+    def freesize(self):
+        return len(self._free)
+
+    async def _acquire(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError('Cannot acquire connection after '
+                                       'closing pool')
+                if self._free:
+                    conn = self._free.popleft()
+                elif self.size < self.maxsize:
+                    conn = _SqliteConnection(self._database, **self._kwargs)
+                    self._used.add(conn)
+                    try:
+                        await conn.connect(self._init)
+                    except BaseException:
+                        self._used.discard(conn)
+                        raise
+                    return conn
+                else:
+                    await self._cond.wait()
+                    continue
+                self._used.add(conn)
+                return conn
+
+    async def release(self, conn):
+        self._used.discard(conn)
+        if not conn.closed:
+            if self._closed:
+                conn.close()
+            else:
+                self._free.append(conn)
+        async with self._cond:
+            if self._closed:
+                # wake wait_closed() as well as the waiting acquirers
+                self._cond.notify_all()
+            else:
+                self._cond.notify()
+
+    def acquire(self):
+        return _SqliteAcquireContext(self)
+
+    def close(self):
+        # the connections in use are closed when they are released
+        self._closed = True
+        while self._free:
+            self._free.popleft().close()
+
+    async def wait_closed(self):
+        if self._cond is None:
+            return
+        async with self._cond:
+            while self._used:
+                await self._cond.wait()
+
+
+class _SqliteAcquireContext(object):
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    async def __aenter__(self):
+        self._conn = await self._pool._acquire()
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        conn, self._conn = self._conn, None
+        await self._pool.release(conn)
+
+
+class AioSqliteDatabase(AioDatabase, SqliteDatabase):
+    """SQLite through the standard sqlite3 module, run in worker threads.
+
+    An in-memory database exists per connection, so its pool is limited to a
+    single connection.
+    """
+
+    system = 'sqlite'
+
+    def __init__(self, database, pragmas=None, *args, **kwargs):
+        self._pragmas = list(pragmas or [])
+        journal_mode = kwargs.pop('journal_mode', None)
+        if journal_mode:
+            self._pragmas.append(('journal_mode', journal_mode))
+        super().__init__(database, *args, **kwargs)
+
+    async def _connect(self, database, minsize=1, maxsize=10, **kwargs):
+        if database == ':memory:':
+            maxsize = 1
+        kwargs.setdefault('check_same_thread', False)
+        return _SqlitePool(database, minsize=minsize, maxsize=maxsize,
+                           init=self._add_conn_hooks, **kwargs)
+
+    # the generic versions of AioDatabase precede SqliteDatabase in the mro
+    extract_date = SqliteDatabase.extract_date
+    truncate_date = SqliteDatabase.truncate_date
+
+    async def create_foreign_key(self, model_class, field, constraint=None):
+        raise OperationalError('SQLite does not support ALTER TABLE '
+                               'statements to add constraints.')
+
+    async def pragma(self, key, value=SENTINEL):
+        sql = 'PRAGMA %s' % key
+        if value is not SENTINEL:
+            sql += ' = %s' % value
+        async with self.get_conn() as conn:
+            cursor = await conn.execute_sql(sql, require_commit=False)
+            return await cursor.fetchone()
+
+    async def _fetchall(self, sql, params=None):
+        async with self.get_conn() as conn:
+            cursor = await conn.execute_sql(sql, params, require_commit=False)
+            return await cursor.fetchall()
+
+    async def get_tables(self, schema=None):
+        rows = await self._fetchall('SELECT name FROM sqlite_master WHERE '
+                                    'type = ? ORDER BY name', ('table',))
+        return [row[0] for row in rows]
+
+    async def get_indexes(self, table, schema=None):
+        rows = await self._fetchall('SELECT name, sql FROM sqlite_master '
+                                    'WHERE tbl_name = ? AND type = ? '
+                                    'ORDER BY name', (table, 'index'))
+        index_to_sql = dict(rows)
+
+        rows = await self._fetchall('PRAGMA index_list("%s")' % table)
+        unique = set(row[1] for row in rows if int(row[2]) == 1)
+
+        index_columns = {}
+        for name in sorted(index_to_sql):
+            rows = await self._fetchall('PRAGMA index_info("%s")' % name)
+            index_columns[name] = [row[2] for row in rows]
+
+        return [IndexMetadata(name, index_to_sql[name], index_columns[name],
+                              name in unique, table)
+                for name in sorted(index_to_sql)]
+
+    async def get_columns(self, table, schema=None):
+        rows = await self._fetchall('PRAGMA table_info("%s")' % table)
+        return [ColumnMetadata(row[1], row[2], not row[3], bool(row[5]), table)
+                for row in rows]
+
+    async def get_primary_keys(self, table, schema=None):
+        rows = await self._fetchall('PRAGMA table_info("%s")' % table)
+        return [row[1] for row in rows if row[-1]]
+
+    async def get_foreign_keys(self, table, schema=None):
+        rows = await self._fetchall('PRAGMA foreign_key_list("%s")' % table)
+        return [ForeignKeyMetadata(row[3], row[2], row[4], table)
+                for row in rows]
+
+    def get_binary_type(self):
+        return sqlite3.Binary
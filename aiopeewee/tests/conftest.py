@@ -1,14 +1,20 @@
 import os
+import json
 import pytest
 import asyncio
 
 from models import *
+from utils import PerfRecorder
 
 # @pytest.fixture
 # async def loop(event_loop):
 #     return event_loop
 
 mysql_host = os.environ.get('MYSQL_HOST', 'localhost')
+postgres_host = os.environ.get('POSTGRES_HOST', 'localhost')
+perf_baselines_path = os.path.join(os.path.dirname(__file__),
+                                   'perf_baselines.json')
+update_baselines = bool(os.environ.get('AIOPEEWEE_UPDATE_BASELINES'))
 
 
 @pytest.yield_fixture(scope='session')
@@ -20,8 +26,14 @@ def event_loop():
 
 @pytest.yield_fixture(scope='session')
 async def database():
-    db.init('test', user='root', password='',
-            host=mysql_host, port=3306)
+    if isinstance(db, AioSqliteDatabase):
+        db.init(':memory:')
+    elif isinstance(db, AioPostgresqlDatabase):
+        db.init('test', user='postgres', password='',
+                host=postgres_host, port=5432)
+    else:
+        db.init('test', user='root', password='',
+                host=mysql_host, port=3306)
     try:
         await db.connect()
         yield db
@@ -37,7 +49,8 @@ async def flushdb(database):
     tables = [User, Blog, BlogTwo, Comment, EmptyModel, NoPKModel,
               Category, UserCategory, UniqueMultiField, Relationship,
               NonIntModel, Note, Flag, NoteFlagNullable, OrderedModel,
-              Parent, Orphan, Child, GCModel, DefaultsModel,
+              Parent, Orphan, Child, ChildPet, OrphanPet, ChildNullableData,
+              GCModel, DefaultsModel,
               TestModelA, TestModelB, TestModelC, Package, PackageItem,
               UniqueModel, Tag, Note, NoteTag]
     try:
@@ -48,3 +61,20 @@ async def flushdb(database):
     # for table in reversed(tables):
     #     await table.delete()
     # return True
+
+
+@pytest.yield_fixture(scope='session')
+def perf_baselines():
+    with open(perf_baselines_path) as fp:
+        baselines = json.load(fp)
+    yield baselines
+    if update_baselines:
+        with open(perf_baselines_path, 'w') as fp:
+            json.dump(baselines, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+
+
+@pytest.fixture
+def perf(request, perf_baselines):
+    return PerfRecorder(db, request.node.name, perf_baselines,
+                        update=update_baselines)
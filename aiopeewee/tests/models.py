@@ -1,3 +1,4 @@
+import os
 import datetime
 import sys
 
@@ -5,10 +6,21 @@ from peewee import *
 # from playhouse.tests.base import TestModel
 # from playhouse.tests.base import test_db
 
-from aiopeewee import AioModel, AioMySQLDatabase
-
-
-db = AioMySQLDatabase(None)
+from aiopeewee import (AioModel, AioMySQLDatabase, AioSqliteDatabase,
+                       AioPostgresqlDatabase, AioAsyncpgDatabase)
+
+
+# AIOPEEWEE_TEST_DB=sqlite runs the tests on an in-memory database,
+# AIOPEEWEE_TEST_DB=postgres (aiopg) or asyncpg on the postgres server at
+# POSTGRES_HOST
+if os.environ.get('AIOPEEWEE_TEST_DB') == 'sqlite':
+    db = AioSqliteDatabase(None)
+elif os.environ.get('AIOPEEWEE_TEST_DB') == 'postgres':
+    db = AioPostgresqlDatabase(None)
+elif os.environ.get('AIOPEEWEE_TEST_DB') == 'asyncpg':
+    db = AioAsyncpgDatabase(None)
+else:
+    db = AioMySQLDatabase(None)
 
 
 class TestModel(AioModel):
@@ -0,0 +1,343 @@
+import asyncio
+import pytest
+
+from peewee import fn, OperationalError
+from models import *
+from utils import mysql_only
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def count_sleeping(seconds):
+    cursor = await db.execute_sql(
+        'SELECT COUNT(*) FROM information_schema.processlist '
+        'WHERE info = %s', ('SELECT SLEEP(%d)' % seconds,))
+    return (await cursor.fetchone())[0]
+
+
+@mysql_only
+async def test_cancel_kills_query(flushdb):
+    task = asyncio.ensure_future(db.execute_sql('SELECT SLEEP(30)'))
+    await asyncio.sleep(0.5)
+    assert await count_sleeping(30) == 1
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0.1)
+    assert await count_sleeping(30) == 0
+
+    # the pool still hands out working connections
+    await User.create(username='u1')
+    assert await User.select().count() == 1
+
+
+@mysql_only
+async def test_cancel_kills_replica_query(flushdb):
+    # the server doubles as its replica, the pools tell them apart
+    replica_db = AioMySQLDatabase(db.database, replicas=[{}],
+                                  **db.connect_kwargs)
+    await replica_db.connect()
+    pools = []
+    new_conn = replica_db._new_conn
+
+    def recording_new_conn(pool=None):
+        pools.append(pool)
+        return new_conn(pool)
+
+    async def sleep():
+        async with replica_db.get_conn(read_only=True) as conn:
+            await conn.execute_sql('SELECT SLEEP(32)')
+
+    try:
+        task = asyncio.ensure_future(sleep())
+        await asyncio.sleep(0.5)
+        assert await count_sleeping(32) == 1
+
+        replica_db._new_conn = recording_new_conn
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.1)
+        assert pools == [replica_db.replica_pools[0]]
+        assert await count_sleeping(32) == 0
+
+        # the lag is read from the replica, which does not replicate
+        del pools[:]
+        assert await replica_db.replication_lag() is None
+        assert pools == [replica_db.replica_pools[0]]
+    finally:
+        await replica_db.close()
+
+
+@mysql_only
+async def test_cancel_inside_transaction(flushdb):
+    async def txn():
+        async with db.atomic():
+            await User.create(username='u1')
+            await db.execute_sql('SELECT SLEEP(31)')
+
+    task = asyncio.ensure_future(txn())
+    await asyncio.sleep(0.5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0.1)
+
+    assert await count_sleeping(31) == 0
+    assert await User.select().count() == 0
+
+
+@mysql_only
+async def test_query_timeout(flushdb):
+    query = User.select(fn.SLEEP(2)).timeout(0.5)
+    await User.create(username='u1')
+    with pytest.raises(OperationalError):
+        await query.scalar()
+    await asyncio.sleep(0.1)
+    assert await count_sleeping(2) == 0
+
+    db.timeout = 0.5
+    try:
+        with pytest.raises(OperationalError):
+            await db.execute_sql('SELECT SLEEP(3)')
+        # per-query setting wins over the database default
+        assert await User.select(fn.SLEEP(1)).timeout(5).scalar() == 0
+    finally:
+        db.timeout = None
+
+
+async def test_execution_hooks(flushdb):
+    events = []
+
+    def before(sql, params, connection_id):
+        events.append(('before', sql))
+
+    def after(sql, params, duration, rowcount, connection_id):
+        assert duration >= 0
+        events.append(('after', sql, rowcount))
+
+    def on_error(sql, params, duration, exc, connection_id):
+        events.append(('error', sql, type(exc)))
+
+    db.add_hook('before_execute', before)
+    db.add_hook('after_execute', after)
+    db.add_hook('on_error', on_error)
+    try:
+        await db.execute_sql('SELECT 1', require_commit=False)
+        with pytest.raises(Exception):
+            await db.execute_sql('SELECT * FROM missing_table',
+                                 require_commit=False)
+    finally:
+        db.remove_hook('before_execute', before)
+        db.remove_hook('after_execute', after)
+        db.remove_hook('on_error', on_error)
+
+    assert events[0] == ('before', 'SELECT 1')
+    assert events[1][:2] == ('after', 'SELECT 1')
+    assert events[2] == ('before', 'SELECT * FROM missing_table')
+    assert events[3][:2] == ('error', 'SELECT * FROM missing_table')
+    assert db._hooks == {}
+
+    with pytest.raises(ValueError):
+        db.add_hook('after_commit', after)
+
+
+@mysql_only
+async def test_execution_hooks_rowcount(flushdb):
+    events = []
+
+    def before(sql, params, connection_id):
+        events.append(('before', sql))
+
+    def after(sql, params, duration, rowcount, connection_id):
+        events.append(('after', sql, rowcount))
+
+    db.add_hook('before_execute', before)
+    db.add_hook('after_execute', after)
+    try:
+        await db.execute_sql('SELECT 1', require_commit=False)
+        with pytest.raises(Exception):
+            await db.execute_sql('SELECT * FROM missing_table',
+                                 require_commit=False)
+    finally:
+        db.remove_hook('before_execute', before)
+        db.remove_hook('after_execute', after)
+
+    assert events[:3] == [('before', 'SELECT 1'),
+                          ('after', 'SELECT 1', 1),
+                          ('before', 'SELECT * FROM missing_table')]
+
+
+async def test_slow_query_log(flushdb, tmpdir):
+    path = str(tmpdir.join('slow.log'))
+    log = db.slow_query_log(threshold=0, size=2, path=path)
+    try:
+        await User.create(username='u1')
+        await User.select().where(User.username == 'u1').count()
+        await User.select().where(User.username == 'u2')
+    finally:
+        await log.stop()
+
+    assert len(log.entries) == 2
+    entry = log.entries[-1]
+    assert entry['sql'].startswith('SELECT')
+    assert entry['params'] == ['u2']
+    assert entry['location'].startswith(__file__)
+    assert entry['query'] == 'AioSelectQuery(User)'
+    assert entry['plan']
+
+    with open(path) as fp:
+        assert len(fp.readlines()) == 3
+
+    assert db._hooks == {}
+    await User.select().count()
+    assert log.entries[-1] is entry
+
+
+@mysql_only
+async def test_slow_query_log_plan(flushdb):
+    log = db.slow_query_log(threshold=0)
+    try:
+        await User.select().where(User.username == 'u2')
+    finally:
+        await log.stop()
+
+    assert 'query_block' in log.entries[-1]['plan']
+
+
+async def test_pool_stats(flushdb):
+    before = db.pool_stats()
+    db.pool_metrics.time_queries = True
+    try:
+        async with db.atomic():
+            await User.create(username='u1')
+            assert db.pool_stats()['in_use'] == before['in_use'] + 1
+            await User.select().count()
+    finally:
+        db.pool_metrics.time_queries = False
+
+    stats = db.pool_stats()
+    assert stats['in_use'] == before['in_use']
+    assert stats['waiters'] == 0
+    assert stats['size'] <= stats['maxsize']
+    assert stats['hold_time']['count'] == before['hold_time']['count'] + 1
+    assert stats['query_time']['count'] == before['query_time']['count'] + 1
+    assert stats['query_time']['sum'] > before['query_time']['sum']
+    assert stats['created'] >= 1
+
+    # statements are not timed by default
+    await User.select().count()
+    assert db.pool_stats()['query_time'] == stats['query_time']
+
+
+async def test_statement_stats(flushdb):
+    db.statements.start()
+    try:
+        for username in ('u1', 'u2', 'u3'):
+            await User.create(username=username)
+        await User.select().where(User.id << [1, 2]).count()
+        await User.select().where(User.id << [3]).count()
+        with pytest.raises(Exception):
+            await db.execute_sql('SELECT * FROM missing_table WHERE id = 1')
+    finally:
+        db.statements.stop()
+
+    stats = {s['fingerprint'].replace(db.quote_char, '`'): s
+             for s in db.statement_stats(reset=True)}
+    insert = stats['INSERT INTO `users` (`username`) VALUES (...)']
+    assert insert['calls'] == 3
+    assert insert['rows'] == 3
+    count = stats['SELECT Count(*) FROM `users` AS t1 '
+                  'WHERE (`t1`.`id` IN (...))']
+    assert count['calls'] == 2
+    assert count['p99_time'] >= count['mean_time'] > 0
+    missing = stats['SELECT * FROM missing_table WHERE id = ?']
+    assert missing['errors'] == 1
+    assert db.statement_stats() == []
+
+
+async def test_query_budget(flushdb):
+    from aiopeewee.metrics import QueryBudgetExceeded
+
+    user = await User.create(username='u1')
+    for i in range(3):
+        await Blog.create(user=user, title='b%d' % i)
+
+    with pytest.raises(QueryBudgetExceeded) as excinfo:
+        async with db.query_budget(warn_repeated=3, strict=True):
+            for blog in await Blog.select():
+                await blog.user
+    report = str(excinfo.value)
+    assert report.startswith('3 times: SELECT')
+    assert __file__ in report
+
+    with pytest.raises(QueryBudgetExceeded):
+        async with db.query_budget(max_queries=1, strict=True):
+            await User.select().count()
+            await Blog.select().count()
+
+    async with db.query_budget(max_queries=2, warn_repeated=3, strict=True):
+        await User.select().count()
+        await Blog.select().join(User).count()
+    assert db._hooks == {}
+
+
+async def test_tracing_spans(flushdb):
+    from aiopeewee.tracing import Tracer
+
+    db.tracer = tracer = Tracer()
+    try:
+        async with db.atomic():
+            await User.create(username='u1')
+        assert len(await User.select()) == 1
+    finally:
+        db.tracer = None
+
+    spans = {span.name: span
+             for span in tracer.exporter.get_finished_spans()}
+    assert set(spans) == {'db.connection.acquire', 'db.transaction',
+                          'db.query', 'db.fetch'}
+    query, fetch = spans['db.query'], spans['db.fetch']
+    assert query.attributes['db.system'] == db.system
+    assert query.attributes['db.operation'] == 'SELECT'
+    assert query.attributes['db.statement'].startswith('SELECT')
+    assert fetch.attributes['db.response.returned_rows'] == 1
+    assert fetch.parent is None and fetch.status == 'UNSET'
+    assert all(span.duration >= 0 for span in spans.values())
+
+
+async def test_gather(flushdb):
+    await User.insert_many([{'username': 'u%d' % i} for i in range(5)]).execute()
+    others = User.select().where(User.username << ['u1', 'u2', 'u3', 'u4'])
+
+    users, count, first, updated = await db.gather(
+        others.order_by(User.username),
+        others.count(),
+        others.select(fn.MIN(User.username)).scalar(),
+        User.update(username='x').where(User.username == 'u0'),
+        limit=2)
+    assert [user.username for user in users] == ['u1', 'u2', 'u3', 'u4']
+    assert (count, first, updated) == (4, 'u1', 1)
+
+    running = [0, 0]
+
+    async def track():
+        running[0] += 1
+        running[1] = max(running)
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+
+    await db.gather(*[track() for _ in range(6)], limit=2)
+    assert running[1] == min(2, db.pool.maxsize)
+
+    with pytest.raises(DatabaseError):
+        await db.gather(User.select(), User.raw('SELECT * FROM missing'))
+    results = await db.gather(User.raw('SELECT * FROM missing'),
+                              others.count(), return_exceptions=True)
+    assert isinstance(results[0], DatabaseError) and results[1] == 4
+
+    with pytest.raises(OperationalError):
+        async with db.atomic():
+            await db.gather(User.select().count(), User.select().count())
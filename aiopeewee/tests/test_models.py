@@ -1,7 +1,7 @@
 import sys
 import pytest
 
-from utils import assert_query_count, assert_queries_equal
+from utils import assert_query_count, assert_queries_equal, mysql_only
 from functools import partial
 
 from models import *
@@ -10,7 +10,7 @@ from peewee import SQL, fn, R, QueryCompiler
 from peewee import ModelOptions
 
 from aiopeewee import AioModel as Model
-from aiopeewee import AioMySQLDatabase
+from aiopeewee import AioMySQLDatabase, model_to_dict
 from aiopeewee.utils import alist
 
 
@@ -913,6 +913,39 @@ async def test_deleting(flushdb):
     assert u2 == await User.get(User.username=='u2')
 
 
+async def test_execute_in_chunks(flushdb):
+    await User.create_users(10)
+
+    query = User.update(username='x').where(User.username != 'u5')
+    progress = [p async for p in query.execute_in_chunks(4)]
+    assert [(p.chunk, p.rows, p.total_rows) for p in progress] == [
+        (1, 4, 4), (2, 4, 8), (3, 1, 9)]
+    assert progress[-1].last_key is None
+    assert await User.select().where(User.username == 'x').count() == 9
+
+    throttled = []
+    query = User.delete().where(User.username != 'u5')
+    async for p in query.execute_in_chunks(3, pause=0.01,
+                                           throttle=throttled.append):
+        assert p.rows <= 3
+    assert p.total_rows == 9
+    assert len(throttled) == p.chunk - 1
+    assert [u.username async for u in User.select()] == ['u5']
+
+
+@mysql_only
+async def test_execute_in_chunks_expression(flushdb):
+    await User.create_users(10)
+
+    query = User.update(username=fn.CONCAT(User.username, '-x'))
+    query = query.where(User.id > 1)
+    progress = [p async for p in query.execute_in_chunks(4)]
+    assert [(p.chunk, p.rows, p.total_rows) for p in progress] == [
+        (1, 4, 4), (2, 4, 8), (3, 1, 9)]
+    assert progress[-1].last_key is None
+    assert await User.select().where(User.username.endswith('-x')).count() == 9
+
+
 async def test_counting(flushdb):
     u1 = await User.create(username='u1')
     u2 = await User.create(username='u2')
@@ -2140,6 +2173,60 @@ async def create_parent_orphan_child():
     await Orphan.create(data='orphan2-noparent')
 
 
+async def create_parent_child_pets():
+    await create_parent_orphan_child()
+    async for child in Child.select():
+        await ChildPet.create(child=child)
+        await ChildNullableData.create(child=child, data=child.data)
+    async for orphan in Orphan.select():
+        await OrphanPet.create(orphan=orphan)
+
+
+async def test_delete_many_recursive(flushdb):
+    await create_parent_child_pets()
+    p1, p2 = await Parent.select().order_by(Parent.id)
+
+    with assert_query_count(5, ignore_txn=True):
+        assert await Parent.delete_many([p1], recursive=True) == 1
+
+    counts = (
+        (Child.select(), Child.parent, 0, 2, 2),
+        (Orphan.select(), Orphan.parent, 0, 0, 4),
+        (ChildPet.select().join(Child), Child.parent, 0, 2, 2),
+        (OrphanPet.select().join(Orphan), Orphan.parent, 0, 0, 4),
+    )
+    for query, fk, p1_ct, p2_ct, tot in counts:
+        assert await query.where(fk == p1.id).count() == p1_ct
+        assert await query.where(fk == p2.id).count() == p2_ct
+        assert await query.count() == tot
+    assert await (ChildNullableData.select()
+                  .where(ChildNullableData.child >> None)
+                  .count()) == 2
+
+
+async def test_delete_many_query(flushdb):
+    await create_parent_child_pets()
+
+    query = Parent.select().where(Parent.data << ['p1', 'p2'])
+    with assert_query_count(6, ignore_txn=True):
+        assert await Parent.delete_many(query, recursive=True,
+                                        delete_nullable=True) == 2
+
+    for model in (Parent, Child, Orphan, ChildPet, OrphanPet,
+                  ChildNullableData):
+        expected = 2 if model in (Orphan, OrphanPet) else 0
+        assert await model.select().count() == expected
+
+    for i in range(4):
+        await Package.create(barcode=str(i))
+        await PackageItem.create(package=str(i), title=str(i))
+
+    query = Package.select().order_by(Package.barcode).limit(3)
+    assert await Package.delete_many(query, recursive=True) == 3
+    assert [p.barcode async for p in Package.select()] == ['3']
+    assert [i.title async for i in PackageItem.select()] == ['3']
+
+
 async def test_no_empty_instances(flushdb):
     await create_parent_orphan_child()
 
@@ -2237,6 +2324,84 @@ async def test_default_dirty(flushdb):
     assert dm3_db.field == 4
 
 
+async def test_bulk_update(flushdb):
+    users = [await User.create(username=f'u{i}') for i in range(5)]
+    blogs = [await Blog.create(user=u, title=f'b{i}')
+             for i, u in enumerate(users)]
+
+    users[0].username = 'u0-x'
+    users[3].username = 'u3-x'
+    with assert_query_count(1):
+        assert await User.bulk_update(users) == 2
+    assert not any(u.is_dirty() for u in users)
+
+    names = [u.username async for u in User.select().order_by(User.id)]
+    assert names == ['u0-x', 'u1', 'u2', 'u3-x', 'u4']
+
+    # Instances contribute different dirty fields, batched by two.
+    blogs[0].title = 'b0-x'
+    blogs[1].content = 'c1'
+    blogs[2].user = users[4]
+    blogs[4].title = 'b4-x'
+    blogs[4].content = 'c4'
+    with assert_query_count(3):
+        assert await Blog.bulk_update(blogs, batch_size=2) == 4
+
+    query = Blog.select().order_by(Blog.pk)
+    assert [(b.title, b.content, b.user_id) async for b in query] == [
+        ('b0-x', '', users[0].id),
+        ('b1', 'c1', users[1].id),
+        ('b2', '', users[4].id),
+        ('b3', '', users[3].id),
+        ('b4-x', 'c4', users[4].id)]
+
+    # Explicit fields are written regardless of the dirty state.
+    for blog in blogs:
+        blog.content = 'same'
+    with assert_query_count(1):
+        await Blog.bulk_update(blogs, fields=[Blog.content])
+    assert await Blog.select().where(Blog.content == 'same').count() == 5
+
+    with assert_query_count(0):
+        assert await User.bulk_update(users) == 0
+
+    with pytest.raises(ValueError):
+        await User.bulk_update([User(username='unsaved')], fields=['username'])
+
+
+async def create_users_with_blogs(users=1, blogs=3):
+    for i in range(users):
+        user = await User.create(username='u%d' % i)
+        for j in range(blogs):
+            await Blog.create(user=user, title='b%d-%d' % (i, j))
+
+
+async def test_perf_bulk_update(flushdb, perf):
+    await create_users_with_blogs(blogs=10)
+    blogs = await Blog.select()
+    for blog in blogs:
+        blog.title = blog.title.upper()
+    async with perf:
+        await Blog.bulk_update(blogs, fields=[Blog.title])
+
+
+async def test_perf_model_to_dict_fk(flushdb, perf):
+    await create_users_with_blogs()
+    async with perf:
+        blogs = await Blog.select().order_by(Blog.pk)
+        data = [await model_to_dict(blog) for blog in blogs]
+    assert [d['user']['username'] for d in data] == ['u0'] * 3
+
+
+async def test_perf_model_to_dict_join(flushdb, perf):
+    await create_users_with_blogs()
+    async with perf:
+        blogs = await (Blog.select(Blog, User).join(User)
+                       .order_by(Blog.pk))
+        data = [await model_to_dict(blog) for blog in blogs]
+    assert [d['user']['username'] for d in data] == ['u0'] * 3
+
+
 async def test_function_coerce(database):
     db = database
 
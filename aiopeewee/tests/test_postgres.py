@@ -0,0 +1,110 @@
+import pytest
+
+from models import *
+from aiopeewee.postgres import _native_sql
+from utils import assert_query_count, postgres_only, asyncpg_only
+
+
+pytestmark = pytest.mark.asyncio
+
+
+@postgres_only
+async def test_insert_many_return_id_list(flushdb):
+    rows = [{'username': 'u%d' % i} for i in range(3)]
+    with assert_query_count(1):
+        ids = list(await User.insert_many(rows).return_id_list().execute())
+    users = await User.select().order_by(User.id)
+    assert ids == [user.id for user in users]
+    assert [user.username for user in users] == ['u0', 'u1', 'u2']
+
+
+@postgres_only
+async def test_update_delete_returning(flushdb):
+    await User.insert_many([{'username': 'u%d' % i}
+                            for i in range(3)]).execute()
+
+    with assert_query_count(1):
+        query = (User.update(username=User.username.concat('!'))
+                 .where(User.username != 'u1')
+                 .returning(User.id, User.username))
+        updated = sorted(user.username for user in await query.execute())
+    assert updated == ['u0!', 'u2!']
+
+    with assert_query_count(1):
+        query = User.delete().where(User.username == 'u1').returning(User)
+        deleted = [user.username for user in await query.execute()]
+    assert deleted == ['u1']
+    assert await User.select().count() == 2
+
+
+@postgres_only
+async def test_transaction_rollback(flushdb):
+    with pytest.raises(ValueError):
+        async with db.atomic():
+            await User.create(username='u0')
+            async with db.atomic():
+                await User.create(username='u1')
+            raise ValueError()
+    assert await User.select().count() == 0
+
+    async with db.atomic():
+        await User.create(username='u0')
+        async with db.atomic() as sp:
+            await User.create(username='u1')
+            await sp.rollback()
+    assert [u.username for u in await User.select()] == ['u0']
+
+
+@postgres_only
+async def test_unit_of_work_returns_generated_keys(flushdb):
+    users = [User(username='u%d' % i) for i in range(3)]
+    with assert_query_count(1, ignore_txn=True):
+        async with db.unit_of_work() as uow:
+            uow.add(*users)
+    assert [user.id for user in users] == [
+        user.id for user in await User.select().order_by(User.id)]
+
+
+@postgres_only
+async def test_introspection(flushdb):
+    assert 'users' in await db.get_tables()
+    assert await db.get_primary_keys('blog') == ['pk']
+    fks = await db.get_foreign_keys('blog')
+    assert [(fk.column, fk.dest_table) for fk in fks] == [('user_id', 'users')]
+
+
+@asyncpg_only
+async def test_asyncpg_connection_reuse(flushdb):
+    for i in range(3):
+        await User.create(username='u%d' % i)
+    assert await User.select().count() == 3
+    users = await User.select().where(User.username << ['u0', 'u2'])
+    assert sorted(user.username for user in users) == ['u0', 'u2']
+    assert await User.update(username='x').where(
+        User.username == 'u1').execute() == 1
+
+    stats = db.pool_stats()
+    assert stats['in_use'] == 0
+    assert stats['created'] <= stats['maxsize']
+
+
+def test_native_placeholders():
+    sql, returns_rows = _native_sql(
+        'SELECT "t1"."id" FROM "users" AS t1 '
+        'WHERE ("t1"."username" LIKE %s || \'%%\' AND "t1"."id" IN (%s, %s))')
+    assert sql == ('SELECT "t1"."id" FROM "users" AS t1 '
+                   'WHERE ("t1"."username" LIKE $1 || \'%\' AND '
+                   '"t1"."id" IN ($2, $3))')
+    assert returns_rows
+    assert not _native_sql('UPDATE "users" SET "username" = %s')[1]
+    assert _native_sql('DELETE FROM "users" RETURNING "id"')[1]
+
+    # the main statement of a WITH decides
+    cte = 'WITH "old" AS (SELECT "id" FROM "users" WHERE "id" < %s) '
+    assert not _native_sql(cte + 'UPDATE "users" SET "username" = %s')[1]
+    assert not _native_sql(cte + 'DELETE FROM "users" WHERE "id" IN '
+                                 '(SELECT "id" FROM "old")')[1]
+    assert _native_sql(cte + 'SELECT "id" FROM "old"')[1]
+    assert not _native_sql('WITH "d" AS (DELETE FROM "users" RETURNING "id") '
+                           'UPDATE "blog" SET "title" = \'RETURNING\'')[1]
+    assert _native_sql(cte + 'DELETE FROM "users" RETURNING "id"')[1]
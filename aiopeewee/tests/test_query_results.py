@@ -1,15 +1,16 @@
+import asyncio
 import sys
 import pytest
 import itertools
 
 from models import *
-from utils import assert_queries_equal, assert_query_count
+from utils import assert_queries_equal, assert_query_count, mysql_only
 from peewee import ModelQueryResultWrapper
 from peewee import NaiveQueryResultWrapper
 
 from aiopeewee.result import (AioNaiveQueryResultWrapper,
                               AioModelQueryResultWrapper)
-from aiopeewee.utils import anext, alist
+from aiopeewee.utils import anext, alist, current_task
 
 #from playhouse.tests.base import ModelTestCase
 #from playhouse.tests.base import skip_test_if
@@ -202,6 +203,153 @@ async def test_iterator_extended(flushdb):
     assert accum == [7, 3]
 
 
+async def test_seek(flushdb):
+    await User.create_users(3)
+    users = await User.select().order_by(User.id)
+    for i in range(7):
+        await Blog.create(title='b%d' % (i % 3), user=users[i % 3])
+
+    query = Blog.select().join(User).where(User.username != 'u3')
+    order_by = [Blog.title.desc()]
+    pages = []
+    token = None
+    while True:
+        with assert_query_count(1):
+            rows, token = await query.seek(token, order_by=order_by, limit=2)
+        pages.append([(b.title, b.pk) for b in rows])
+        assert not any(hasattr(b, '_seek0') for b in rows)
+        if token is None:
+            break
+
+    blogs = [(b.title, b.pk) async for b in
+             query.order_by(Blog.title.desc(), Blog.pk)]
+    assert len(blogs) == 5
+    assert sum(pages, []) == blogs
+    assert [len(page) for page in pages] == [2, 2, 1]
+
+    rows, token = await User.select(User.username).tuples().seek(limit=2)
+    assert rows == [('u1',), ('u2',)]
+    rows, token = await (User.select(User.username)
+                             .dicts()
+                             .seek(token, limit=2))
+    assert rows == [{'username': 'u3'}]
+    assert token is None
+
+    with pytest.raises(ValueError):
+        await User.select().seek('bogus')
+
+
+async def test_batches(flushdb):
+    await User.create_users(10)
+    query = User.select().order_by(User.id)
+
+    with assert_query_count(1):
+        batches = [[u.username for u in batch]
+                   async for batch in query.batches(4)]
+    assert batches == [['u1', 'u2', 'u3', 'u4'],
+                       ['u5', 'u6', 'u7', 'u8'],
+                       ['u9', 'u10']]
+
+    batches = [batch async for batch in
+               query.select(User.username).tuples().batches(6)]
+    assert batches == [[('u%d' % i,) for i in range(1, 7)],
+                       [('u%d' % i,) for i in range(7, 11)]]
+
+
+@mysql_only
+async def test_batches_server_side(flushdb):
+    await User.create_users(10)
+    query = User.select().order_by(User.id)
+
+    batches = [batch async for batch in
+               query.select(User.id).dicts().batches(20, server_side=True)]
+    assert [len(batch) for batch in batches] == [10]
+    assert list(batches[0][0]) == ['id']
+
+    async for batch in query.batches(3, server_side=True):
+        break
+    assert await User.select().count() == 10
+
+
+async def test_parallel_scan(flushdb):
+    await User.create_users(20)
+
+    query = User.select().where(User.username != 'u7')
+    expected = [u.username async for u in query.order_by(User.id)]
+
+    ordered = [u.username async for u in
+               query.parallel_scan(partitions=3, ordered=True, buffer=2)]
+    assert ordered == expected
+
+    unordered = [u async for u in
+                 query.tuples().parallel_scan(partitions=4, buffer=2)]
+    assert sorted(unordered) == sorted(
+        await query.tuples().order_by(User.id))
+
+    empty = User.select().where(User.username == 'nobody')
+    assert [u async for u in empty.parallel_scan()] == []
+
+    with pytest.raises(ValueError):
+        [u async for u in query.limit(5).parallel_scan()]
+
+    # the other slices are cancelled and awaited when one of them fails
+    tasks = []
+
+    def fail_first_slice(sql, params, connection_id):
+        if 'MIN(' not in sql.upper():
+            tasks.append(current_task())
+            if len(tasks) == 1:
+                raise ZeroDivisionError()
+
+    db.add_hook('before_execute', fail_first_slice)
+    try:
+        with pytest.raises(ZeroDivisionError):
+            [u async for u in query.parallel_scan(partitions=4, buffer=1)]
+    finally:
+        db.remove_hook('before_execute', fail_first_slice)
+    assert tasks and all(task.done() for task in tasks)
+
+    # a consumer stopping early makes the waiting slices release their
+    # connections themselves, not the loop finalizing their generators later
+    scanning, releasing = [], []
+    released = db.pool_metrics.released
+
+    def record_scan(sql, params, connection_id):
+        if 'MIN(' not in sql.upper():
+            scanning.append(current_task())
+
+    def record_release(*args):
+        releasing.append(current_task())
+        released(*args)
+
+    db.add_hook('before_execute', record_scan)
+    db.pool_metrics.released = record_release
+    try:
+        scan = query.parallel_scan(partitions=4, buffer=1)
+        async for user in scan:
+            # the queue fills up, the slice waits for the consumer
+            await asyncio.sleep(0.1)
+            break
+        await scan.aclose()
+    finally:
+        db.remove_hook('before_execute', record_scan)
+        del db.pool_metrics.released
+    assert db.pool_stats()['in_use'] == 0
+    releasing.remove(current_task())
+    assert releasing and set(releasing) <= set(scanning)
+
+
+async def test_perf_aggregate_rows(flushdb, perf):
+    for i in range(2):
+        user = await User.create(username='u%d' % i)
+        for j in range(3):
+            await Blog.create(user=user, title='b%d-%d' % (i, j))
+    async with perf:
+        users = await (User.select(User, Blog).join(Blog)
+                       .order_by(User.id, Blog.pk).aggregate_rows())
+    assert [len(user.blog_set) for user in users] == [3, 3]
+
+
 async def test_fill_cache(flushdb):
     def assert_usernames(qr, n):
         exp = ['u%d' % i for i in range(1, n + 1)]
@@ -0,0 +1,204 @@
+import uuid
+import pytest
+
+from peewee import CharField, ForeignKeyField, IntegerField, UUIDField, fn
+from aiopeewee import AioModel, AioSqliteDatabase, ShardedAioDatabase
+from aiopeewee.sharding import RangeMapping
+
+
+pytestmark = pytest.mark.asyncio
+
+shards = [AioSqliteDatabase(None), AioSqliteDatabase(None)]
+sharded_db = ShardedAioDatabase(shards, key='tenant',
+                                mapping=RangeMapping([100]))
+
+
+class Invoice(AioModel):
+    tenant = IntegerField()
+    number = CharField()
+    amount = IntegerField()
+
+    class Meta:
+        database = sharded_db
+
+
+class Doc(AioModel):
+    tenant = UUIDField()
+    title = CharField()
+
+    class Meta:
+        database = ShardedAioDatabase(shards, key='tenant')
+
+
+class Tenant(AioModel):
+    name = CharField()
+
+    class Meta:
+        database = shards[0]
+
+
+class Project(AioModel):
+    tenant = ForeignKeyField(Tenant)
+    name = CharField()
+
+    class Meta:
+        database = ShardedAioDatabase(shards, key='tenant',
+                                      mapping=RangeMapping([100]))
+
+
+@pytest.yield_fixture
+async def invoices():
+    for shard in shards:
+        shard.init(':memory:')
+    await sharded_db.connect()
+    try:
+        await Invoice.create_table()
+        for tenant in (1, 2, 101, 102):
+            for i in range(3):
+                await Invoice.create(tenant=tenant, number='%d-%d' % (tenant, i),
+                                     amount=tenant * 10 + i)
+        yield
+    finally:
+        await sharded_db.close()
+
+
+async def shard_count(shard, table='invoice'):
+    cursor = await shard.execute_sql('SELECT COUNT(*) FROM %s' % table)
+    return (await cursor.fetchone())[0]
+
+
+async def test_routing(invoices):
+    assert [await shard_count(shard) for shard in shards] == [6, 6]
+
+    query = Invoice.select().where(Invoice.tenant == 101)
+    assert sorted(i.number for i in await query) == ['101-0', '101-1', '101-2']
+    assert await Invoice.select().shard(2).count() == 6
+
+    await (Invoice.update(amount=0)
+           .where((Invoice.tenant == 2) & (Invoice.number == '2-0'))
+           .execute())
+    assert await Invoice.get(Invoice.number == '2-0', Invoice.tenant == 2)
+    assert (await Invoice.get(Invoice.number == '2-0')).amount == 0
+
+    with pytest.raises(ValueError):
+        await Invoice.delete().where(Invoice.number == '2-0').execute()
+    with pytest.raises(ValueError):
+        await Invoice.delete().where(Invoice.tenant << [1, 101]).execute()
+
+    async with sharded_db.shard_for(101).atomic():
+        await Invoice.delete().where(Invoice.number == '101-0').execute()
+    assert [await shard_count(shard) for shard in shards] == [6, 5]
+
+
+async def test_scatter_gather(invoices):
+    query = Invoice.select().order_by(Invoice.amount.desc()).limit(4)
+    assert [i.amount for i in await query] == [1022, 1021, 1020, 1012]
+
+    query = (Invoice.select(Invoice.tenant, Invoice.number)
+             .where(Invoice.tenant << [2, 102])
+             .order_by(Invoice.tenant, Invoice.number.desc())
+             .paginate(2, 2))
+    assert [i.number for i in await query] == ['2-0', '102-2']
+
+    assert await Invoice.select().count() == 12
+    assert await Invoice.select(fn.MAX(Invoice.amount)).scalar() == 1022
+    assert await Invoice.select().where(Invoice.amount > 1020).exists()
+
+    with pytest.raises(ValueError):
+        await Invoice.select(Invoice.number).order_by(Invoice.amount)
+    with pytest.raises(NotImplementedError):
+        await Invoice.select(fn.AVG(Invoice.amount)).scalar()
+
+
+async def test_scatter_group_by_distinct(invoices):
+    first = Invoice.number.endswith('-0')
+    query = (Invoice.select(first, fn.COUNT(Invoice.id),
+                            fn.MAX(Invoice.amount))
+             .group_by(first)
+             .order_by(first)
+             .tuples())
+    assert await query == [(0, 8, 1022), (1, 4, 1020)]
+    assert await query.limit(1).offset(1) == [(1, 4, 1020)]
+
+    query = Invoice.select(Invoice.number.startswith('1').alias('one'))
+    assert sorted(await query.distinct().tuples()) == [(0,), (1,)]
+    index = Invoice.amount - Invoice.tenant * 10
+    query = Invoice.select(index).distinct().order_by(index)
+    assert [row for row, in await query.tuples()] == [0, 1, 2]
+
+    with pytest.raises(NotImplementedError):
+        await (Invoice.select(first, fn.COUNT(Invoice.id))
+               .group_by(first).having(fn.COUNT(Invoice.id) > 4))
+    with pytest.raises(NotImplementedError):
+        await Invoice.select(
+            fn.COUNT(fn.DISTINCT(Invoice.tenant))).scalar()
+    with pytest.raises(ValueError):
+        await Invoice.select(fn.COUNT(Invoice.id)).group_by(first)
+
+
+async def test_sharded_writes(invoices):
+    with pytest.raises(ValueError):
+        await Invoice.update(tenant=150).where(Invoice.id == 1).execute()
+    with pytest.raises(ValueError):
+        await (Invoice.update(tenant=150)
+               .where(Invoice.tenant == 2).execute())
+
+    # ids are per shard, the key of the instance picks the row
+    invoice = await Invoice.get(Invoice.number == '101-0')
+    invoice.amount = 5
+    assert await invoice.save() == 1
+    assert (await Invoice.get(Invoice.number == '1-0')).amount == 10
+    assert (await Invoice.get(Invoice.number == '101-0')).amount == 5
+    assert await (await Invoice.get(Invoice.number == '2-2')).delete_instance()
+    assert [await shard_count(shard) for shard in shards] == [5, 6]
+
+    invoice, created = await Invoice.get_or_create(
+        tenant=103, number='103-0', defaults={'amount': 1030})
+    assert created
+    assert (await Invoice.get_or_create(tenant=103, number='103-0'))[1] is False
+    assert [await shard_count(shard) for shard in shards] == [5, 7]
+
+    invoices = await Invoice.select().where(Invoice.number.endswith('-0'))
+    assert await Invoice.delete_many(invoices) == 5
+    assert [await shard_count(shard) for shard in shards] == [3, 4]
+    query = Invoice.select().where(Invoice.number.endswith('-1'))
+    assert await Invoice.delete_many(query) == 4
+    assert [await shard_count(shard) for shard in shards] == [1, 2]
+
+
+async def test_uuid_key(invoices):
+    await Doc.create_table()
+    tenants = [uuid.UUID(int=i) for i in range(8)]
+    for tenant in tenants:
+        await Doc.create(tenant=tenant, title=str(tenant))
+    assert [await shard_count(shard, 'doc') for shard in shards] == [4, 4]
+
+    for tenant in tenants:
+        doc = await Doc.get(Doc.tenant == tenant)
+        assert doc.title == str(tenant)
+        assert await Doc.select().shard(tenant).where(
+            Doc.title == str(tenant)).count() == 1
+        async with Doc._meta.database.shard_for(tenant, Doc).atomic():
+            assert await Doc.select().where(
+                Doc.title == str(tenant)).count() == 1
+
+
+async def test_foreign_key(invoices):
+    await Tenant.create_table()
+    await Project.create_table()
+    for tenant in (1, 101):
+        await Tenant.create(id=tenant, name='t%d' % tenant)
+        await Project.create(tenant=tenant, name='p%d' % tenant)
+        await Project.create(tenant=tenant, name='q%d' % tenant)
+
+    # both shards number the projects from 1
+    project = await Project.get(Project.name == 'p101')
+    project.name = 'renamed'
+    assert await project.save() == 1
+    assert (await Project.get(Project.tenant == 1, Project.id == 1)).name == 'p1'
+    assert (await project.tenant).name == 't101'
+    assert await (await Project.get(Project.name == 'q1')).delete_instance()
+
+    projects = await Project.select().where(Project.name != 'q101')
+    assert await Project.delete_many(projects) == 2
+    assert [p.name for p in await Project.select()] == ['q101']
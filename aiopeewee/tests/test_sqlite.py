@@ -0,0 +1,205 @@
+import asyncio
+import pytest
+
+from peewee import CharField, ForeignKeyField
+from aiopeewee import AioModel, AioSqliteDatabase
+
+
+pytestmark = pytest.mark.asyncio
+
+sqlite_db = AioSqliteDatabase(None)
+
+
+class Author(AioModel):
+    name = CharField(unique=True)
+
+    class Meta:
+        database = sqlite_db
+
+
+class Book(AioModel):
+    author = ForeignKeyField(Author, related_name='books')
+    title = CharField()
+
+    class Meta:
+        database = sqlite_db
+
+
+async def test_sqlite_introspection():
+    sqlite_db.init(':memory:')
+    await sqlite_db.connect()
+    try:
+        await sqlite_db.create_tables([Author, Book])
+        assert await sqlite_db.get_tables() == ['author', 'book']
+        columns = await sqlite_db.get_columns('book')
+        assert [c.name for c in columns] == ['id', 'author_id', 'title']
+        assert await sqlite_db.get_primary_keys('book') == ['id']
+        fks = await sqlite_db.get_foreign_keys('book')
+        assert [(fk.column, fk.dest_table) for fk in fks] == [
+            ('author_id', 'author')]
+        indexes = await sqlite_db.get_indexes('author')
+        assert [(i.columns, i.unique) for i in indexes] == [(['name'], True)]
+        # an in-memory database lives in a single connection
+        assert sqlite_db.pool.maxsize == 1
+    finally:
+        await sqlite_db.close()
+
+
+async def test_sqlite_file_pool(tmpdir):
+    sqlite_db.init(str(tmpdir.join('test.db')), maxsize=3)
+    await sqlite_db.connect()
+    try:
+        await sqlite_db.create_tables([Author, Book])
+        author = await Author.create(name='a1')
+
+        async def add_books(n):
+            async with sqlite_db.atomic():
+                for i in range(n):
+                    await Book.create(author=author, title='b%d' % i)
+                return await Book.select().count()
+
+        counts = await asyncio.gather(add_books(2), Author.select().count())
+        assert counts[1] == 1
+        assert await author.books.count() == 2
+        assert sqlite_db.pool.size <= 3
+    finally:
+        await sqlite_db.close()
+
+
+async def test_sqlite_replicas(tmpdir):
+    replica = str(tmpdir.join('replica.db'))
+    sqlite_db.init(replica)
+    await sqlite_db.connect()
+    await sqlite_db.create_tables([Author, Book])
+    await Author.create(name='replica')
+    await sqlite_db.close()
+
+    sqlite_db.init(str(tmpdir.join('primary.db')),
+                   replicas=[{'database': replica}])
+    await sqlite_db.connect()
+    try:
+        await sqlite_db.create_tables([Author, Book])
+        await Author.create(name='primary')
+
+        async def names(query):
+            return [author.name for author in await query]
+
+        assert await names(Author.select()) == ['replica']
+        assert await names(Author.select().using('primary')) == ['primary']
+        assert await names(Author.raw('SELECT * FROM author')) == ['replica']
+        assert (await Author.get(Author.id == 1)).name == 'replica'
+        async with sqlite_db.atomic():
+            assert await names(Author.select()) == ['primary']
+        with pytest.raises(ValueError):
+            Author.select().using('secondary')
+    finally:
+        await sqlite_db.close()
+        sqlite_db.init(None, replicas=[])
+
+
+async def test_sqlite_read_your_writes(tmpdir):
+    replica = str(tmpdir.join('replica.db'))
+    sqlite_db.init(replica)
+    await sqlite_db.connect()
+    await sqlite_db.create_tables([Author, Book])
+    await sqlite_db.close()
+
+    sqlite_db.init(str(tmpdir.join('primary.db')),
+                   replicas=[{'database': replica}])
+    sqlite_db.read_your_writes = True
+    await sqlite_db.connect()
+    try:
+        await sqlite_db.create_tables([Author, Book])
+
+        async def write_and_read():
+            await Author.create(name='a1')
+            # sqlite has no replication position, the primary is read
+            return await Author.select().count()
+
+        assert await asyncio.ensure_future(write_and_read()) == 1
+        # tasks without writes read the replica
+        assert await asyncio.ensure_future(Author.select().count()) == 0
+    finally:
+        sqlite_db.read_your_writes = False
+        await sqlite_db.close()
+        sqlite_db.init(None, replicas=[])
+
+
+async def test_sqlite_close_waits_for_connections(tmpdir):
+    sqlite_db.init(str(tmpdir.join('test.db')))
+    await sqlite_db.connect()
+    pool = sqlite_db.pool
+    async with pool.acquire() as conn:
+        closing = asyncio.ensure_future(sqlite_db.close())
+        await asyncio.sleep(0.01)
+        assert not closing.done()
+        assert not conn.closed
+    await closing
+    assert conn.closed
+    assert pool.size == 0
+
+
+async def test_sqlite_write_position_lookup(tmpdir):
+    lookups = []
+
+    class PositionDatabase(AioSqliteDatabase):
+
+        async def write_position(self, conn):
+            lookups.append(conn)
+            return 'position'
+
+        async def wait_for_position(self, conn, position, timeout):
+            return position == 'position'
+
+    replica = str(tmpdir.join('replica.db'))
+    position_db = PositionDatabase(replica, read_your_writes=True)
+
+    class Note(AioModel):
+        text = CharField()
+
+        class Meta:
+            database = position_db
+
+    await position_db.connect()
+    await Note.create_table()
+    await position_db.close()
+
+    position_db.init(str(tmpdir.join('primary.db')),
+                     replicas=[{'database': replica}])
+    await position_db.connect()
+    try:
+        await Note.create_table()
+
+        async def write_and_read():
+            await Note.create(text='n1')
+            await Note.create(text='n2')
+            # no lookup until a replica read follows the writes
+            assert lookups == []
+            assert await Note.select().count() == 0
+            assert await Note.select().count() == 0
+            assert len(lookups) == 1
+
+        await asyncio.ensure_future(write_and_read())
+    finally:
+        await position_db.close()
+
+
+async def test_sqlite_kill_on_connection_server(tmpdir):
+    kills = []
+
+    class KillDatabase(AioSqliteDatabase):
+
+        async def kill_query(self, thread_id, pool=None):
+            kills.append(pool)
+
+    kill_db = KillDatabase(str(tmpdir.join('primary.db')),
+                           replicas=[{'database': str(tmpdir.join('r.db'))}])
+    await kill_db.connect()
+    try:
+        async with kill_db.get_conn(read_only=True) as conn:
+            await conn.kill()
+        async with kill_db.get_conn() as conn:
+            await conn.kill()
+        assert kills == [kill_db.replica_pools[0], kill_db.pool]
+    finally:
+        await kill_db.close()
@@ -609,3 +609,70 @@ async def test_atomic_with_delete(flushdb):
 
     usernames = [u.username async for u in User.select()]
     assert usernames == ['u0']
+
+
+async def test_atomic_rollback(flushdb):
+    await User.create(username='u0')
+
+    with pytest.raises(ValueError):
+        async with db.atomic():
+            await User.create(username='u1')
+            raise ValueError()
+
+    with pytest.raises(ValueError):
+        async with db.atomic():
+            await User.create(username='u2')
+            try:
+                async with db.atomic():
+                    await User.create(username='u3')
+                    raise KeyError()
+            except KeyError:
+                pass
+            assert await User.select().count() == 2
+            raise ValueError()
+
+    usernames = [u.username async for u in User.select()]
+    assert usernames == ['u0']
+
+
+async def test_unit_of_work(flushdb):
+    u0 = await User.create(username='u0')
+    u1 = await User.create(username='u1')
+    b0 = await Blog.create(user=u0, title='b0')
+
+    async with db.unit_of_work() as uow:
+        u2 = User(username='u2')
+        uow.add(u2, Blog(user=u2, title='b2'))
+        uow.add(TestModelA(field='a', data='a'),
+                TestModelA(field='b', data='b'), force_insert=True)
+        u0.username = 'u0-x'
+        uow.add(u0)
+        uow.delete(b0, u1)
+        assert await User.select().count() == 2
+
+    assert [u.username async for u in User.select().order_by(User.id)] == [
+        'u0-x', 'u2']
+    assert [(b.title, b.user_id) async for b in Blog.select()] == [
+        ('b2', u2.id)]
+    assert await TestModelA.select().count() == 2
+
+    with pytest.raises(ValueError):
+        async with db.unit_of_work() as uow:
+            uow.add(User(username='u3'))
+            raise ValueError()
+    assert await User.select().count() == 2
+
+    await NonIntModel.create(pk='a', data='a')
+    uow = db.unit_of_work()
+    u3, dup = User(username='u3'), NonIntModel(pk='a', data='b')
+    uow.add(u3, dup, force_insert=True)
+    with pytest.raises(IntegrityError):
+        await uow.flush()
+    assert u3.id is None
+    assert await User.select().count() == 2
+
+    uow.delete(dup)
+    await uow.flush()
+    assert u3.id is not None
+    assert await User.select().count() == 3
+    assert not uow.created
@@ -1,8 +1,25 @@
+import gc
+import sys
 import logging
+import tracemalloc
+import pytest
 
 from peewee import logger
 from contextlib import contextmanager
 
+from aiopeewee import (AioMySQLDatabase, AioPostgresqlDatabase,
+                       AioAsyncpgDatabase)
+from aiopeewee.database import AioConnection
+from models import db
+
+
+mysql_only = pytest.mark.skipif(not isinstance(db, AioMySQLDatabase),
+                                reason='MySQL specific')
+postgres_only = pytest.mark.skipif(not isinstance(db, AioPostgresqlDatabase),
+                                   reason='PostgreSQL specific')
+asyncpg_only = pytest.mark.skipif(not isinstance(db, AioAsyncpgDatabase),
+                                  reason='asyncpg specific')
+
 
 class QueryLogHandler(logging.Handler):
 
@@ -46,3 +63,115 @@ def assert_queries_equal(queries, expected, db):
                         .replace('%%', db.interpolation))
         assert sql == expected_sql
         assert params == expected_params
+
+
+class _CountingCursor(object):
+    """Counts the rows fetched from a driver cursor."""
+
+    def __init__(self, cursor, counts):
+        self._cursor = cursor
+        self._counts = counts
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    async def fetchone(self):
+        row = await self._cursor.fetchone()
+        if row is not None:
+            self._counts['rows'] += 1
+        return row
+
+    async def fetchmany(self, *args):
+        rows = await self._cursor.fetchmany(*args)
+        self._counts['rows'] += len(rows)
+        return rows
+
+    async def fetchall(self):
+        rows = await self._cursor.fetchall()
+        self._counts['rows'] += len(rows)
+        return rows
+
+
+class PerfRecorder(object):
+    """Counts the statements, fetched rows and connections used in a block.
+
+    The counts are deterministic, so they must match the test's entry in the
+    committed baselines: more is a regression, less means the baselines are
+    out of date. The memory allocated by the block (the tracemalloc peak, in
+    KiB) depends on the interpreter and the driver, it is only compared when
+    the baseline was recorded with the same python version and database
+    class, within ALLOCATION_TOLERANCE.
+    """
+
+    ALLOCATION_TOLERANCE = 0.25
+
+    def __init__(self, db, name, baselines, update=False):
+        self.db = db
+        self.name = name
+        self.baselines = baselines
+        self.update = update
+        self.counts = {'queries': 0, 'rows': 0, 'connections': 0}
+        self.allocated = None
+
+    def after_execute(self, sql, params, duration, rowcount, connection_id):
+        self.counts['queries'] += 1
+
+    async def __aenter__(self):
+        execute_sql = self._execute_sql = AioConnection.execute_sql
+        counts = self.counts
+
+        async def counting_execute_sql(conn, *args, **kwargs):
+            cursor = await execute_sql(conn, *args, **kwargs)
+            return _CountingCursor(cursor, counts)
+
+        AioConnection.execute_sql = counting_execute_sql
+        self._acquired = self.db.pool_metrics.acquire_wait.count
+        self.db.add_hook('after_execute', self.after_execute)
+        self._tracing = not tracemalloc.is_tracing()
+        if self._tracing:
+            # collections at varying points would make the peak vary
+            gc.collect()
+            gc.disable()
+            tracemalloc.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._tracing:
+            self.allocated = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+            gc.enable()
+        self.db.remove_hook('after_execute', self.after_execute)
+        AioConnection.execute_sql = self._execute_sql
+        self.counts['connections'] = (self.db.pool_metrics.acquire_wait.count -
+                                      self._acquired)
+        if exc_type is not None:
+            return
+        python = '%d.%d' % sys.version_info[:2]
+        backend = type(self.db).__name__
+        if self.update:
+            baseline = dict(self.counts)
+            if self.allocated is not None:
+                baseline.update(allocated_kib=self.allocated, python=python,
+                                backend=backend)
+            self.baselines[self.name] = baseline
+            return
+
+        baseline = self.baselines.get(self.name)
+        assert baseline is not None, (
+            'No baseline for %s, run the tests with '
+            'AIOPEEWEE_UPDATE_BASELINES=1' % self.name)
+        changes = ['%s: %d != %d' % (key, self.counts[key], baseline.get(key))
+                   for key in sorted(self.counts)
+                   if self.counts[key] != baseline.get(key)]
+        if (self.allocated is not None and 'allocated_kib' in baseline and
+                baseline.get('python') == python and
+                baseline.get('backend') == backend):
+            expected = baseline['allocated_kib']
+            if (abs(self.allocated - expected) >
+                    expected * self.ALLOCATION_TOLERANCE):
+                changes.append('allocated_kib: %d != %d' % (self.allocated,
+                                                            expected))
+        assert not changes, (
+            'Performance counts of %s differ from the baseline (%s), update '
+            'the baselines with AIOPEEWEE_UPDATE_BASELINES=1 if this is an '
+            'improvement' % (self.name, ', '.join(changes)))
@@ -0,0 +1,114 @@
+import time
+import random
+from weakref import WeakKeyDictionary
+
+from .utils import current_task
+
+
+class Span(object):
+    """A timed operation, modeled after OpenTelemetry spans.
+
+    Attributes follow the OpenTelemetry database semantic conventions
+    (db.system, db.name, db.statement, db.operation), times are nanoseconds
+    since the epoch.
+    """
+
+    def __init__(self, tracer, name, attributes, parent=None):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else random.getrandbits(128)
+        self.span_id = random.getrandbits(64)
+        self.status = 'UNSET'
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def duration(self):
+        """Duration in seconds."""
+        return (self.end_time - self.start_time) / 1e9
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start_time = int(time.time() * 1e9)
+        self.tracer._stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end_time = int(time.time() * 1e9)
+        if exc_type is not None:
+            self.status = 'ERROR'
+            self.attributes['exception.type'] = exc_type.__name__
+            self.attributes['exception.message'] = str(exc_val)
+        stack = self.tracer._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.tracer.exporter.export([self])
+
+    def __repr__(self):
+        return '<Span %s %s>' % (self.name, self.attributes)
+
+
+class _NoopSpan(object):
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class InMemorySpanExporter(object):
+    """Keeps the finished spans, mainly for tests."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+    def get_finished_spans(self):
+        return list(self.spans)
+
+    def clear(self):
+        self.spans = []
+
+
+class Tracer(object):
+    """Creates spans, nested by task, and hands the finished ones to the
+    exporter.
+
+    Any object with an ``export(spans)`` method can be the exporter, e.g. one
+    forwarding the spans to an OpenTelemetry SDK.
+    """
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter or InMemorySpanExporter()
+        self._stacks = WeakKeyDictionary()
+        self._untasked = []
+
+    def _stack(self):
+        task = current_task()
+        if task is None:
+            return self._untasked
+        try:
+            return self._stacks[task]
+        except KeyError:
+            stack = self._stacks[task] = []
+            return stack
+
+    def current_span(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def start_span(self, name, attributes=None):
+        return Span(self, name, attributes or {}, self.current_span())
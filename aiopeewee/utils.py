@@ -1,3 +1,8 @@
+import asyncio
+
+_current_task = getattr(asyncio, 'current_task', None) or \
+    asyncio.Task.current_task
+
 
 class AsyncIterWrapper:
     """Async wrapper for sync iterables
@@ -27,3 +32,18 @@ async def alist(iterable):
 
 async def anext(iterable):
     return await iterable.__anext__()
+
+
+def current_task():
+    """Return the running task or None when called outside of a task."""
+    try:
+        return _current_task()
+    except RuntimeError:
+        return None
+
+
+async def close_cursor(cursor):
+    """Close a cursor, aiopg closes them synchronously."""
+    result = cursor.close()
+    if result is not None:
+        await result
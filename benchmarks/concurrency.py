@@ -0,0 +1,256 @@
+"""End-to-end concurrency benchmark against a MySQL server.
+
+Concurrent tasks run a mix of primary key gets, filtered selects,
+insert_many, save() updates and atomic() transactions for a fixed duration,
+once for every pool size. Start the server of the docker-compose file (or
+any local mysqld with an empty `test` database) first:
+
+    docker-compose up -d mysql
+    python benchmarks/concurrency.py --tasks 64 --pool-sizes 5 10 20 \\
+        --json results.json
+    # after a change, compare against the previous results
+    python benchmarks/concurrency.py --tasks 64 --pool-sizes 5 10 20 \\
+        --compare results.json
+
+Reports the throughput, the latency percentiles of every operation and the
+time spent waiting for a pool connection.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+
+from peewee import CharField, IntegerField, ForeignKeyField, DatabaseError
+
+from aiopeewee import AioModel, AioMySQLDatabase
+from aiopeewee.metrics import PoolMetrics
+
+
+db = AioMySQLDatabase(None)
+
+
+class Account(AioModel):
+    name = CharField()
+    balance = IntegerField(default=0)
+
+    class Meta:
+        database = db
+        db_table = 'bench_account'
+
+
+class Transfer(AioModel):
+    account = ForeignKeyField(Account, related_name='transfers')
+    amount = IntegerField()
+
+    class Meta:
+        database = db
+        db_table = 'bench_transfer'
+
+
+async def op_get(rng, accounts):
+    await Account.get(Account.id == rng.randint(1, accounts))
+
+
+async def op_select(rng, accounts):
+    low = rng.randint(1, accounts)
+    await (Account.select()
+           .where(Account.id.between(low, low + 50), Account.balance >= 0)
+           .order_by(Account.balance.desc()))
+
+
+async def op_insert_many(rng, accounts):
+    rows = [{'account': rng.randint(1, accounts), 'amount': rng.randint(1, 9)}
+            for _ in range(10)]
+    await Transfer.insert_many(rows).execute()
+
+
+async def op_save(rng, accounts):
+    account = await Account.get(Account.id == rng.randint(1, accounts))
+    account.balance += 1
+    await account.save()
+
+
+async def op_atomic(rng, accounts):
+    async with db.atomic():
+        account = await Account.get(Account.id == rng.randint(1, accounts))
+        account.balance -= 1
+        await account.save()
+        await Transfer.create(account=account, amount=1)
+
+
+OPERATIONS = {
+    'get': op_get,
+    'select': op_select,
+    'insert_many': op_insert_many,
+    'save': op_save,
+    'atomic': op_atomic,
+}
+DEFAULT_MIX = {'get': 40, 'select': 25, 'insert_many': 10, 'save': 15,
+               'atomic': 10}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'mean': sum(latencies) / len(latencies) if latencies else None,
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else None,
+    }
+
+
+async def setup(accounts):
+    await db.drop_tables([Account, Transfer], safe=True)
+    await db.create_tables([Account, Transfer])
+    for start in range(0, accounts, 1000):
+        rows = [{'name': 'account %d' % i}
+                for i in range(start, min(start + 1000, accounts))]
+        await Account.insert_many(rows).execute()
+
+
+async def worker(rng, mix, accounts, deadline, latencies, errors):
+    names, weights = zip(*mix.items())
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            await OPERATIONS[name](rng, accounts)
+        except DatabaseError:
+            # lock wait timeouts and deadlocks of the contended updates
+            errors[name] += 1
+        else:
+            latencies[name].append(time.perf_counter() - start)
+
+
+async def run(args, pool_size, mix):
+    db.init(args.database, host=args.host, port=args.port, user=args.user,
+            password=args.password, minsize=1, maxsize=pool_size)
+    await db.connect()
+    try:
+        await setup(args.accounts)
+        db.pool_metrics = PoolMetrics()
+
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*[
+            worker(random.Random(args.seed + i), mix, args.accounts,
+                   deadline, latencies, errors)
+            for i in range(args.tasks)])
+        elapsed = time.perf_counter() - start
+        pool = db.pool_stats()
+        await db.drop_tables([Account, Transfer], safe=True)
+    finally:
+        await db.close()
+
+    ops = sum(len(values) for values in latencies.values())
+    return {
+        'pool_size': pool_size,
+        'operations': ops,
+        'throughput': ops / elapsed,
+        'errors': dict(errors),
+        'latency': {name: summarize(values)
+                    for name, values in sorted(latencies.items())},
+        'pool_wait': pool['acquire_wait'],
+        'pool_hold': pool['hold_time'],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result, baseline=None):
+    line = 'pool {pool_size:>3}: {throughput:>9,.1f} ops/s'.format(**result)
+    if baseline:
+        line += ' ({:+.1%})'.format(
+            result['throughput'] / baseline['throughput'] - 1)
+    wait = result['pool_wait']
+    if wait['count']:
+        line += ', pool wait mean {:.2f}ms p99 {:.2f}ms'.format(
+            wait['mean'] * 1000, wait['p99'] * 1000)
+    print(line)
+    for name, latency in result['latency'].items():
+        line = '    {:>12} {:>7} ops  p50 {:>7.2f}ms  p95 {:>7.2f}ms  ' \
+               'p99 {:>7.2f}ms'.format(name, latency['count'],
+                                       latency['p50'] * 1000,
+                                       latency['p95'] * 1000,
+                                       latency['p99'] * 1000)
+        if baseline and name in baseline['latency']:
+            line += ' ({:+.1%} p95)'.format(
+                latency['p95'] / baseline['latency'][name]['p95'] - 1)
+        errors = result['errors'].get(name)
+        if errors:
+            line += '  %d errors' % errors
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default=os.environ.get('MYSQL_HOST',
+                                                         '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--database', default='test')
+    parser.add_argument('--tasks', type=int, default=32,
+                        help='number of concurrent tasks')
+    parser.add_argument('--pool-sizes', nargs='+', type=int,
+                        default=[5, 10, 20])
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to run for each pool size')
+    parser.add_argument('--accounts', type=int, default=10000)
+    parser.add_argument('--mix', type=json.loads, default=DEFAULT_MIX,
+                        help='operation weights as JSON, default: %s' %
+                        json.dumps(DEFAULT_MIX))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results of a previous run')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.mix) - set(OPERATIONS)
+    if unknown:
+        parser.error('unknown operations: %s' % ', '.join(sorted(unknown)))
+
+    baselines = {}
+    if args.compare:
+        with open(args.compare) as fp:
+            baselines = {run['pool_size']: run
+                         for run in json.load(fp)['runs']}
+
+    loop = asyncio.get_event_loop()
+    runs = []
+    for pool_size in args.pool_sizes:
+        result = loop.run_until_complete(run(args, pool_size, args.mix))
+        report(result, baselines.get(pool_size))
+        runs.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'commit': git_commit(), 'python': sys.version,
+                       'tasks': args.tasks, 'duration': args.duration,
+                       'accounts': args.accounts, 'mix': args.mix,
+                       'runs': runs}, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
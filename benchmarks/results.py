@@ -0,0 +1,189 @@
+"""Micro-benchmarks of the result wrappers, without a database.
+
+Synthetic rows are served by an in-memory cursor behaving like the buffered
+aiomysql cursor, so only the hydration path is measured: row processing,
+model construction and the async iteration overhead.
+
+    python benchmarks/results.py
+    python benchmarks/results.py --rows 1000 1000000 --columns 4 --json out.json
+
+Reports rows per second and the peak memory allocated (tracemalloc, in a
+separate run as tracing slows the allocations down).
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+from peewee import CharField, IntegerField, ForeignKeyField
+
+from aiopeewee import AioModel, AioMySQLDatabase
+from aiopeewee.utils import alist
+
+
+db = AioMySQLDatabase(None)
+
+WRAPPERS = ('naive', 'model', 'tuples', 'dicts', 'aggregate')
+
+
+class FakeCursor(object):
+    """Serves pre-built rows like aiomysql's buffered Cursor.
+
+    The buffered cursor's fetch methods return already resolved futures.
+    """
+
+    def __init__(self, columns, rows):
+        self.description = [(name, None, None, None, None, None, True)
+                            for name in columns]
+        self.rowcount = len(rows)
+        self._rows = rows
+        self._pos = 0
+        self._loop = asyncio.get_event_loop()
+
+    def _result(self, value):
+        fut = self._loop.create_future()
+        fut.set_result(value)
+        return fut
+
+    def fetchone(self):
+        if self._pos >= len(self._rows):
+            return self._result(None)
+        row = self._rows[self._pos]
+        self._pos += 1
+        return self._result(row)
+
+    def fetchmany(self, size=1):
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return self._result(rows)
+
+    def fetchall(self):
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return self._result(rows)
+
+    async def close(self):
+        pass
+
+
+def make_models(ncolumns):
+    attrs = {'Meta': type('Meta', (), {'database': db,
+                                       'db_table': 'parent'})}
+    for i in range(ncolumns):
+        attrs['c%d' % i] = IntegerField() if i % 2 else CharField()
+    Parent = type('Parent%d' % ncolumns, (AioModel,), attrs)
+
+    attrs = {'Meta': type('Meta', (), {'database': db,
+                                       'db_table': 'child'}),
+             'parent': ForeignKeyField(Parent, related_name='children')}
+    for i in range(ncolumns):
+        attrs['c%d' % i] = IntegerField() if i % 2 else CharField()
+    Child = type('Child%d' % ncolumns, (AioModel,), attrs)
+    return Parent, Child
+
+
+def make_query(kind, Parent, Child):
+    if kind == 'naive':
+        return Parent.select()
+    elif kind == 'tuples':
+        return Parent.select().tuples()
+    elif kind == 'dicts':
+        return Parent.select().dicts()
+    elif kind == 'model':
+        return Child.select(Child, Parent).join(Parent)
+    elif kind == 'aggregate':
+        return (Parent.select(Parent, Child).join(Child)
+                .order_by(Parent.id).aggregate_rows())
+    raise ValueError('Unknown wrapper "%s"' % kind)
+
+
+def make_rows(query, nrows, children=4):
+    """Rows for the selected fields, a parent has `children` children."""
+    joined = len(set(field.model_class for field in query._select)) > 1
+
+    def value(field, i):
+        if isinstance(field, ForeignKeyField):
+            return i // children
+        is_parent = 'parent' not in field.model_class._meta.fields
+        key = i // children if joined and is_parent else i
+        if isinstance(field, IntegerField):
+            return key
+        return 'value %d' % key
+
+    return [tuple(value(field, i) for field in query._select)
+            for i in range(nrows)]
+
+
+def column_names(query):
+    return [field.name for field in query._select]
+
+
+async def hydrate(query, rows):
+    ResultWrapper = query._get_result_wrapper()
+    cursor = FakeCursor(column_names(query), rows)
+    qr = ResultWrapper(query.model_class, cursor, query.get_query_meta())
+    return len(await alist(qr))
+
+
+async def measure(kind, nrows, ncolumns):
+    Parent, Child = make_models(ncolumns)
+    query = make_query(kind, Parent, Child)
+    rows = make_rows(query, nrows)
+
+    start = time.perf_counter()
+    objects = await hydrate(query, rows)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    await hydrate(query, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'wrapper': kind,
+        'rows': nrows,
+        'columns': ncolumns,
+        'objects': objects,
+        'seconds': elapsed,
+        'rows_per_sec': nrows / elapsed,
+        'peak_bytes': peak,
+        'bytes_per_row': peak / nrows,
+    }
+
+
+async def run(wrappers, row_counts, column_counts):
+    results = []
+    for kind in wrappers:
+        for ncolumns in column_counts:
+            for nrows in row_counts:
+                result = await measure(kind, nrows, ncolumns)
+                results.append(result)
+                print('{wrapper:>10} {rows:>8} rows {columns:>3} cols '
+                      '{rows_per_sec:>12,.0f} rows/s '
+                      '{bytes_per_row:>8,.0f} B/row'.format(**result))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--wrappers', nargs='+', choices=WRAPPERS,
+                        default=WRAPPERS)
+    parser.add_argument('--rows', nargs='+', type=int,
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--columns', nargs='+', type=int, default=[2, 8, 32])
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args(argv)
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(
+        run(args.wrappers, args.rows, args.columns))
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'python': sys.version, 'results': results}, fp,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()